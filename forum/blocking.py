@@ -0,0 +1,26 @@
+import asyncio
+import logging
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+
+class BlockingCallDetector(monitoring.CommandListener):
+    """
+    Debug-mode pymongo listener that logs Mongo commands sent from a thread running an asyncio event loop.
+    Such calls block every connection served by that loop and must go through `db_sync_to_async`.
+    """
+
+    def started(self, event):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        logger.warning("Blocking Mongo command %r sent on the event loop", event.command_name, stack_info=True)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
@@ -0,0 +1,65 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+PUBLIC_RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+
+def get_cache_generation(namespace):
+    """
+    Current generation of a cache namespace. It is a part of every key in the namespace,
+    so bumping it invalidates all cached responses at once.
+    """
+    # A generation that was evicted restarts from the current time, not from a value used before
+    return cache.get_or_set(f"generation:{namespace}", time.time_ns, timeout=None)
+
+
+def invalidate_cache_namespace(namespace):
+    try:
+        cache.incr(f"generation:{namespace}")
+    except ValueError:
+        cache.set(f"generation:{namespace}", time.time_ns(), timeout=None)
+
+
+def build_response_cache_key(namespace, request, view_name, view_kwargs):
+    query = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+    arguments = urlencode(sorted(view_kwargs.items()))
+    digest = hashlib.md5(f"{request.get_host()}/{view_name}?{arguments}&{query}".encode("utf-8")).hexdigest()
+    return f"response:{namespace}:{get_cache_generation(namespace)}:{digest}"
+
+
+def cache_anonymous_response(namespace, timeout=PUBLIC_RESPONSE_CACHE_TIMEOUT):
+    """
+    Cache successful JSON responses of a ViewSet action for anonymous users.
+
+    The rendered JSON is stored under a key built from the action, its URL kwargs and the
+    normalized query parameters, so a cache hit skips the database, serialization and rendering.
+    Authenticated users always get a fresh response, since they see role-specific fields.
+    Call `invalidate_cache_namespace(namespace)` when the underlying data changes.
+    """
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.user.is_authenticated or request.accepted_renderer.format != "json":
+                return view_method(self, request, *args, **kwargs)
+
+            key = build_response_cache_key(namespace, request, view_method.__name__, kwargs)
+            content = cache.get(key)
+            if content is not None:
+                return HttpResponse(content, content_type="application/json")
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, JSONRenderer().render(response.data), timeout)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,54 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def build_etag(request, updated_at):
+    """
+    ETag of a resource version as seen by the current user.
+    Investors, startups and anonymous users get different fields, and investors see
+    their own invested amounts, so the user and the role flags are part of the tag.
+    """
+    user = request.user
+    if user.is_authenticated:
+        viewer = f"{user.id}:{int(user.is_investor)}:{int(user.is_startup)}"
+    else:
+        viewer = "anonymous"
+    return quote_etag(hashlib.md5(f"{updated_at.isoformat()}:{viewer}".encode("utf-8")).hexdigest())
+
+
+def conditional_response(get_queryset):
+    """
+    Add ETag/Last-Modified headers to a ViewSet action and answer If-None-Match /
+    If-Modified-Since with 304 Not Modified.
+
+    `get_queryset(request, *args, **kwargs)` must return a queryset of the model with
+    an `updated_at` field, narrowed to the requested object. Only `updated_at` is fetched,
+    so a 304 costs one primary key lookup instead of a full serialization.
+    """
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            try:
+                updated_at = get_queryset(request, *args, **kwargs).values_list("updated_at", flat=True).first()
+            except (TypeError, ValueError):
+                updated_at = None
+            if updated_at is None:
+                return view_method(self, request, *args, **kwargs)
+
+            etag = build_etag(request, updated_at)
+            last_modified = int(updated_at.timestamp())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.headers.setdefault("ETag", etag)
+                response.headers.setdefault("Last-Modified", http_date(last_modified))
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) pagination for list endpoints.
+
+    Instead of OFFSET, every page is fetched with a `WHERE (key) < (last seen key)`
+    condition over the `ordering` fields, so page 1000 costs the same as page 1.
+    The cursor returned in `next` is an opaque base64 token with the ordering values
+    of the last row on the page.
+
+    Subclasses can change `ordering` (the last field must be unique, e.g. `id`),
+    and `q_class` for non-Django querysets (e.g. `mongoengine.Q`).
+
+    Query parameters:
+    - cursor: The token returned in the `next` field of the previous page.
+    - page_size: Number of items per page (capped by `max_page_size`).
+    """
+
+    ordering = ("-registration_date", "-id")
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+    q_class = Q
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        try:
+            if cursor is not None:
+                queryset = queryset.filter(self.get_keyset_filter(cursor))
+            rows = list(queryset.order_by(*self.ordering)[: self.page_size + 1])
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_keyset_filter(self, cursor):
+        """
+        Build `(f1 < v1) OR (f1 = v1 AND f2 < v2) OR ...` for the ordering fields
+        (`>` for ascending fields).
+        """
+        keyset_filter = None
+        equal_to = {}
+        for field, value in zip(self.ordering, cursor):
+            field_name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = self.q_class(**equal_to, **{f"{field_name}__{lookup}": value})
+            keyset_filter = condition if keyset_filter is None else keyset_filter | condition
+            equal_to[field_name] = value
+        return keyset_filter
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        values = [str(getattr(last, field.lstrip("-"))) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values))
+
+    @staticmethod
+    def encode_cursor(values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8"))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(values, list)
+            or len(values) != len(self.ordering)
+            or not all(isinstance(value, str) for value in values)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+
+class RankedKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination for full-text search results, most relevant first.
+    The queryset must be annotated with `rank`.
+    """
+
+    ordering = ("-rank", "-id")
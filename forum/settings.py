@@ -17,6 +17,8 @@ from pathlib import Path
 import mongoengine
 from dotenv import load_dotenv
 
+from forum.blocking import BlockingCallDetector
+
 # from decouple import config
 
 
@@ -45,6 +47,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt",
     "django_rest_passwordreset",
@@ -102,6 +105,37 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Online state of chat users
+PRESENCE_REDIS_URL = os.getenv(
+    "PRESENCE_REDIS_URL", os.getenv("REDIS_URL", f"redis://{os.getenv('REDIS_URL_FOR_CHANNELS')}:6379/0")
+)
+
+# Cache for public responses, falls back to local memory when Redis is not configured
+REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL", os.getenv("REDIS_URL"))
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+        },
+        # Token claims change and session revocation markers (users.authentication).
+        # An evicted marker makes a stale token trusted again, so point TOKEN_CACHE_URL
+        # to a Redis server with maxmemory-policy noeviction.
+        "tokens": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("TOKEN_CACHE_URL", REDIS_CACHE_URL),
+            "KEY_PREFIX": "tokens",
+            "TIMEOUT": None,
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
 AUTH_USER_MODEL = "users.CustomUser"
 
 # Database
@@ -120,7 +154,11 @@ DATABASES = {
 
 # Added MongoDB
 MONGO_DB = os.environ.get("MONGO_DATABASE")
-mongoengine.connect(MONGO_DB)
+mongoengine.connect(MONGO_DB, event_listeners=[BlockingCallDetector()] if DEBUG else [])
+
+# Threads running database calls of the chat consumers
+CHAT_DB_EXECUTOR_WORKERS = int(os.getenv("CHAT_DB_EXECUTOR_WORKERS", 8))
+CHAT_WRITE_QUEUE_SIZE = int(os.getenv("CHAT_WRITE_QUEUE_SIZE", 1000))
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -167,7 +205,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.StatelessJWTAuthentication",
     ),
     'EXCEPTION_HANDLER': 'forum.exceptions.custom_exception_handler',
 }
@@ -203,7 +241,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
     "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.ClaimsTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
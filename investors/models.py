@@ -15,6 +15,7 @@ class Investor(models.Model):
     number_for_investor_validation = models.IntegerField(null=True)
     is_active = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = "investors"
@@ -5,6 +5,7 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from forum.conditional import conditional_response
 from projects.models import Project
 from projects.permissions import IsInvestor
 from projects.serializers import ProjectSerializer
@@ -51,6 +52,7 @@ class InvestorViewSet(viewsets.ViewSet):
         tags=["INVESTORS"],
         responses=fetch_particular_investor_GET,
     )
+    @conditional_response(lambda request, pk=None: Investor.objects.filter(id=pk, is_active=True))
     def retrieve(self, request, pk=None):
         investor = get_object_or_404(Investor, id=pk, is_active=True)
         serializer = InvestorSerializer(investor)
@@ -187,6 +189,7 @@ class InvestorViewSet(viewsets.ViewSet):
         responses=fetch_my_profile_responses_GET,
     )
     @action(detail=False, methods=["get"], url_path="profile")
+    @conditional_response(lambda request: Investor.objects.filter(user_id=request.user.id, is_active=True))
     def get_my_profile(self, request):
         """
         Retrieve the authenticated user's profile.
@@ -202,11 +205,7 @@ class InvestorViewSet(viewsets.ViewSet):
         Raises:
         Http404: If the authenticated user does not exist or does not have an associated active investor profile
         """
-        jwt_token = request.auth
-        user_id = jwt_token.payload.get("id")
-        user_instance = CustomUser.objects.get(id=user_id)
-
-        investor = get_object_or_404(Investor, user=user_instance, is_active=True)
+        investor = get_object_or_404(Investor, user_id=request.user.id, is_active=True)
         serializer = InvestorSerializer(investor)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
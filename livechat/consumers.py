@@ -1,136 +1,150 @@
+import asyncio
 import datetime
 import json
-import base64
-from io import BytesIO
-from PIL import Image
 
-from django.core.files.base import ContentFile
-from channels.db import database_sync_to_async
+from bson import ObjectId
+from bson.errors import InvalidId
 from channels.generic.websocket import AsyncWebsocketConsumer
-from livechat.models import LastLogin, Livechat, Status
-from users.models import CustomUser
+from mongoengine.errors import ValidationError
+from pymongo.errors import PyMongoError
+from livechat.models import HISTORY_PAGE_SIZE, LastLogin, Livechat, UnreadCounter
+from users.utils import get_display_names
 
+from .executor import db_sync_to_async
 from .models import Chats
+from .presence import HEARTBEAT_INTERVAL, OFFLINE_DELAY, Presence
+from .tasks import create_image_thumbnails
+from .uploads import MAX_PENDING_UPLOADS, UPLOAD_CHUNK_SIZE, ChunkedUpload, UploadError
+from .writer import message_writer
+
+background_tasks = set()
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
-        self.first_name = self.scope["user"].first_name
-        self.last_name = self.scope["user"].last_name
-        self.username = f"{self.first_name} {self.last_name}"
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"chat_{self.room_name}"
+        self.uploads = {}
+        self.last_delivered = None
 
-        self.chat = await self.get_chat_object(self.room_name)
-        if not self.chat:
+        if not await self.is_chat_member():
             await self.close()
+            return
+        self.participant_names = await self.get_participant_names()
+        self.username = self.participant_names.get(self.user.id)
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
         await self.accept()
         await self.update_last_login()
-        await self.send_status("Online")
-        statuses = Status.objects.filter(room_name=self.room_name)
-        for status in statuses:
-            await self.channel_layer.group_send(
-                self.room_group_name,
+        await self.join_presence()
+
+        await self.send_history()
+
+    async def send_history(self, before=None):
+        """
+        Send one page of the room history, newest first. Usernames come from the participant map.
+        Media are sent as references. The client asks for older messages with
+        {"type": "load_older", "before": <cursor>}, where the cursor is the `before` field of the last page.
+        """
+        messages = await self.get_chat_history(self.room_name, before)
+        has_more = len(messages) > HISTORY_PAGE_SIZE
+        messages = messages[:HISTORY_PAGE_SIZE]
+        usernames = self.participant_names
+        unknown_senders = {message.sender_id for message in messages} - usernames.keys()
+        if unknown_senders:
+            usernames = {**usernames, **await self.get_usernames(unknown_senders)}
+        await self.send(
+            text_data=json.dumps(
                 {
-                    "type": "status_update",
-                    "user_id": status.user_id,
-                    "status": status.status,
-                },
-            )
-
-        history = self.get_chat_history(self.room_name)
-        for message in history:
-            sender_id = message.sender_id
-            username = await self.get_username(sender_id)
-            if message.image:
-                image = Image.open(BytesIO(message.image.read()))
-                image_bytes = BytesIO()
-                image.save(image_bytes, format=image.format)
-                image_data = image_bytes.getvalue()
-
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                data_to_send = {
-                    "image": image_base64,
-                    "username": username,
-                    "timestamp": message.send_at.strftime("%m/%d/%Y, %H:%M:%S"),
-                    "type": "chat_history",
-                    "sender_id": message.sender_id,
-                }
-            elif message.audio:
-                audio_data = message.audio.read()
-                audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                data_to_send = {
-                    "audio": audio_base64,
-                    "text": message.text,
-                    "username": username,
-                    "timestamp": message.send_at.strftime("%m/%d/%Y, %H:%M:%S"),
-                    "type": "chat_history",
-                    "sender_id": message.sender_id,
-                }
-            elif message.video:
-                video_data = message.video.read()
-                video_base64 = base64.b64encode(video_data).decode('utf-8')
-                data_to_send = {
-                    "video": video_base64,
-                    "text": message.text,
-                    "username": username,
-                    "timestamp": message.send_at.strftime("%m/%d/%Y, %H:%M:%S"),
                     "type": "chat_history",
-                    "sender_id": message.sender_id,
+                    "messages": [self.serialize_history_message(message, usernames) for message in messages],
+                    "before": self.encode_history_cursor(messages[-1]) if has_more else None,
                 }
-            else:
-                data_to_send = {
-                    "message": message.text,
-                    "username": username,
-                    "timestamp": message.send_at.strftime("%m/%d/%Y, %H:%M:%S"),
-                    "type": "chat_history",
-                    "sender_id": message.sender_id,
-                }
-            await self.send(
-                text_data=json.dumps(data_to_send)
             )
+        )
+
+    @staticmethod
+    def serialize_history_message(message, usernames):
+        data = {
+            "id": str(message.id),
+            "username": usernames.get(message.sender_id),
+            "timestamp": message.send_at.strftime("%m/%d/%Y, %H:%M:%S"),
+            "sender_id": message.sender_id,
+        }
+        media_type, media = message.get_media_reference()
+        if media_type:
+            data[media_type] = media
+            data["text"] = message.text
+        else:
+            data["message"] = message.text
+        return data
+
+    @classmethod
+    def build_envelope(cls, message, username):
+        """
+        A new message as sent to the sockets: the history item format with the media type
+        (or "chat") as the event type. The id and timestamp come from the server.
+        """
+        media_type, _ = message.get_media_reference()
+        return {"type": media_type or "chat", **cls.serialize_history_message(message, {message.sender_id: username})}
+
+    @staticmethod
+    def encode_history_cursor(message):
+        return {"send_at": message.send_at.isoformat(), "id": str(message.id)}
+
+    @staticmethod
+    def decode_history_cursor(cursor):
+        try:
+            return datetime.datetime.fromisoformat(cursor["send_at"]), ObjectId(cursor["id"])
+        except (KeyError, TypeError, ValueError, InvalidId):
+            return None
+
+    async def join_presence(self):
+        """
+        Send the room's online users to this socket in one snapshot message.
+        The others are told only when the user was not online already (e.g. in another tab).
+        """
+        self.presence = Presence(self.room_name, self.user.id, self.channel_name)
+        online_users = await self.presence.join()
+        await self.send(
+            text_data=json.dumps({"type": "presence_snapshot", "online": sorted(online_users | {self.user.id})})
+        )
+        if self.user.id not in online_users:
+            await self.send_status("Online")
+        self.heartbeat_task = asyncio.create_task(self.send_heartbeats())
+
+    async def send_heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await self.presence.heartbeat()
+
+    async def leave_presence(self):
+        self.heartbeat_task.cancel()
+        await self.presence.leave()
+        # Keep a reference, the event loop holds tasks only weakly
+        task = asyncio.create_task(self.send_offline_status())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    async def send_offline_status(self):
+        """
+        Report the user offline only if they did not reconnect within OFFLINE_DELAY.
+        """
+        await asyncio.sleep(OFFLINE_DELAY + 1)
+        if self.user.id not in await Presence.get_online_users(self.room_name):
+            await self.send_status("Offline")
 
     async def send_status(self, status):
-        await self.update_users_status(status)
         await self.channel_layer.group_send(
             self.room_group_name,
             {"type": "status_update", "user_id": self.user.id, "status": status},
         )
 
-    async def update_last_login(self):
-        last_login = LastLogin.objects.filter(
-            room_name=self.room_name, user_id=self.user.id
-        ).first()
-        if last_login:
-            last_login.last_seen = datetime.datetime.now()
-            last_login.save()
-        else:
-            LastLogin.objects.create(
-                room_name=self.room_name,
-                user_id=self.user.id,
-                last_seen=datetime.datetime.now(),
-            )
-
-    @database_sync_to_async
-    def update_users_status(self, status_arg):
-        if Status.objects.filter(room_name=self.room_name, user_id=self.user.id):
-            status = Status.objects.get(room_name=self.room_name, user_id=self.user.id)
-            status.status = status_arg
-            status.save()
-        else:
-            status = Status.objects.create(
-                room_name=self.room_name, user_id=self.user.id, status=status_arg
-            )
-            status.save()
-
-    @database_sync_to_async
-    def get_participant_status(self, participant):
-        status = Status.objects.get(room_name=self.room_name, user_id=participant.id)
-        return status
+    @db_sync_to_async
+    def update_last_login(self):
+        LastLogin.touch(self.room_name, self.user.id)
 
     async def status_update(self, event):
         user_id = event["user_id"]
@@ -142,217 +156,215 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
-        await self.send_status("Offline")
+        for upload in self.uploads.values():
+            await db_sync_to_async(upload.abort)()
+        self.uploads.clear()
+        if hasattr(self, "presence"):
+            await self.leave_presence()
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            await self.receive_upload_chunk(bytes_data)
+            return
         text_data_json = json.loads(text_data)
         type = text_data_json.get("type")
-        if type == "image":
-            image_data = text_data_json.get('file')
-            if image_data:
-                image_bytes = base64.b64decode(image_data)
-                sender_id = text_data_json.get("sender_id")
-                username = text_data_json.get("username")
-                timestamp = text_data_json.get("timestamp")
-
-                await self.save_image(image_bytes)
-
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat.image",
-                        "image": image_base64,  # Отправляем обратно байты изображения
-                        "sender_id": sender_id,
-                        "username": username,
-                        "timestamp": timestamp,
-                    },
-                )
-        elif type == "audio":
-            file_data = text_data_json.get('file')
-            if file_data:
-                file_bytes = base64.b64decode(file_data)
-                text = text_data_json.get("name")
-                sender_id = text_data_json.get("sender_id")
-                username = text_data_json.get("username")
-                timestamp = text_data_json.get("timestamp")
-
-                await self.save_audio(file_bytes, text)
-                file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat.audio",
-                        "text": text,
-                        "audio": file_base64,
-                        "sender_id": sender_id,
-                        "username": username,
-                        "timestamp": timestamp,
-                    },
-                )
-        elif type == "video":
-            file_data = text_data_json.get('file')
-            if file_data:
-                file_bytes = base64.b64decode(file_data)
-                text = text_data_json.get("name")
-                sender_id = text_data_json.get("sender_id")
-                username = text_data_json.get("username")
-                timestamp = text_data_json.get("timestamp")
-
-                await self.save_video(file_bytes, text)
-                file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat.video",
-                        "text": text,
-                        "video": file_base64,
-                        "sender_id": sender_id,
-                        "username": username,
-                        "timestamp": timestamp,
-                    },
-                )
+        if type == "load_older":
+            before = self.decode_history_cursor(text_data_json.get("before"))
+            if before is None:
+                await self.send(text_data=json.dumps({"type": "error", "message": "Invalid cursor"}))
+            else:
+                await self.send_history(before)
+        elif type == "upload_start":
+            await self.start_upload(text_data_json)
+        elif type == "upload_commit":
+            await self.commit_upload(text_data_json.get("upload_id"))
+        elif type == "upload_abort":
+            upload = self.uploads.pop(text_data_json.get("upload_id"), None)
+            if upload:
+                await db_sync_to_async(upload.abort)()
+        elif type == "mark_read":
+            await self.mark_read(text_data_json.get("message_id"))
         else:
-            message = text_data_json.get("message")
-            sender_id = text_data_json.get("sender_id")
-            username = text_data_json.get("username")
-            timestamp = text_data_json.get("timestamp")
-
-            await self.save_message(message)
-
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat.message",
-                    "message": message,
-                    "username": username,
-                    "timestamp": timestamp,
-                    "sender_id": sender_id,
-                },
-            )
-
-    async def save_image(self, image_bytes):
-        image_name = f"{self.room_name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-        image = ContentFile(image_bytes, name=image_name)
-        await database_sync_to_async(Livechat.create_message)(
-            sender_id=self.user.id,
-            room_name=self.scope["url_route"]["kwargs"]["room_name"],
-            image=image,
-        )
-
-    async def save_video(self, video_bytes, text):
-        file_name = f"{self.room_name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.mp4"
-        file = ContentFile(video_bytes, name=file_name)
-        await database_sync_to_async(Livechat.create_message)(
-            sender_id=self.user.id,
-            room_name=self.scope["url_route"]["kwargs"]["room_name"],
-            video=file,
-            text=text
-        )
-
-    async def save_message(self, message):
-        await database_sync_to_async(Livechat.create_message)(
-            sender_id=self.user.id,
-            room_name=self.scope["url_route"]["kwargs"]["room_name"],
-            text=message,
-        )
-
-    async def save_audio(self, audio_bytes, text):
-        file_name = f"{self.room_name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.mp3"
-        file = ContentFile(audio_bytes, name=file_name)
-        await database_sync_to_async(Livechat.create_message)(
-            sender_id=self.user.id,
-            room_name=self.scope["url_route"]["kwargs"]["room_name"],
-            audio=file,
-            text=text
+            await self.send_chat_message(text_data_json.get("message"))
+
+    async def send_chat_message(self, text):
+        """
+        Broadcast a text message first and persist it afterwards through the write-behind queue.
+        """
+        try:
+            message = Livechat.build_message(self.user.id, self.room_name, text=text)
+        except ValidationError:
+            await self.send(text_data=json.dumps({"type": "error", "message": "Invalid message"}))
+            return
+
+        await self.broadcast_message(message)
+
+    async def broadcast_message(self, message):
+        """
+        Send a new message to the room and queue it for writing.
+        The JSON for the sockets is encoded once here and every consumer of the group forwards it as is.
+        """
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                "type": "chat.envelope",
+                "id": str(message.id),
+                "send_at": message.send_at.isoformat(),
+                "text": json.dumps(self.build_envelope(message, self.username)),
+            },
         )
-
-    async def chat_message(self, event):
-        message = event["message"]
-        username = event["username"]
-        sender_id = event["sender_id"]
-
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "chat",
-                    "message": message,
-                    "username": username,
-                    "sender_id": sender_id,
-                    "timestamp": datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
-                }
+        await self.queue_write(message)
+
+    async def queue_write(self, message):
+        saved = await message_writer.put(message, self.get_recipient_ids())
+        task = asyncio.create_task(self.confirm_saved(message, saved))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    async def confirm_saved(self, message, saved):
+        """
+        Tell the sender when the message is stored, or that it was lost after all retries.
+        Thumbnails of an image are queued only once the message is stored, the task loads it from Mongo.
+        """
+        try:
+            await saved
+        except PyMongoError:
+            await self.send(text_data=json.dumps({"type": "message_failed", "id": str(message.id)}))
+            return
+        await self.send(text_data=json.dumps({"type": "message_saved", "id": str(message.id)}))
+        if message.image:
+            await db_sync_to_async(create_image_thumbnails.delay)(str(message.id))
+
+    async def start_upload(self, data):
+        if len(self.uploads) >= MAX_PENDING_UPLOADS:
+            await self.send_upload_error(None, "Too many uploads in progress")
+            return
+        try:
+            upload = await db_sync_to_async(ChunkedUpload)(
+                data.get("media_type"), data.get("name"), data.get("content_type"), data.get("size")
             )
-        )
-
-    async def chat_video(self, event):
-        text = event["text"]
-        video_bytes = event["video"]
-        sender_id = event["sender_id"]
-        username = event["username"]
+        except UploadError as e:
+            await self.send_upload_error(None, str(e))
+            return
+        self.uploads[upload.id.hex] = upload
         await self.send(
             text_data=json.dumps(
-                {
-                    "type": "video",
-                    "text": text,
-                    "video": video_bytes,
-                    "sender_id": sender_id,
-                    "username": username,
-                    "timestamp": datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
-                }
+                {"type": "upload_ready", "upload_id": upload.id.hex, "chunk_size": UPLOAD_CHUNK_SIZE}
             )
         )
 
-    async def chat_image(self, event):
-        image_bytes = event["image"]
-        sender_id = event["sender_id"]
-        username = event["username"]
-
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "image",
-                    "image": image_bytes,
-                    "sender_id": sender_id,
-                    "username": username,
-                    "timestamp": datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
-                }
-            )
+    async def receive_upload_chunk(self, frame):
+        try:
+            upload_id, sequence, chunk = ChunkedUpload.parse_frame(frame)
+        except UploadError as e:
+            await self.send_upload_error(None, str(e))
+            return
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            await self.send_upload_error(upload_id, "Unknown upload")
+            return
+        try:
+            await db_sync_to_async(upload.write)(sequence, chunk)
+        except UploadError as e:
+            await self.abort_upload(upload_id, str(e))
+            return
+        await self.send(text_data=json.dumps({"type": "upload_ack", "upload_id": upload_id, "sequence": sequence}))
+
+    async def commit_upload(self, upload_id):
+        upload = self.uploads.pop(upload_id, None)
+        if upload is None:
+            await self.send_upload_error(upload_id, "Unknown upload")
+            return
+        try:
+            grid_id = await db_sync_to_async(upload.commit)()
+        except UploadError as e:
+            self.uploads[upload_id] = upload
+            await self.abort_upload(upload_id, str(e))
+            return
+
+        message = Livechat.build_media_message(
+            sender_id=self.user.id,
+            room_name=self.room_name,
+            media_type=upload.media_type,
+            grid_id=grid_id,
+            size=upload.size,
+            content_type=upload.content_type,
+            text=upload.filename if upload.media_type != "image" else "",
+        )
+        await self.broadcast_message(message)
+
+    async def abort_upload(self, upload_id, error):
+        upload = self.uploads.pop(upload_id, None)
+        if upload:
+            await db_sync_to_async(upload.abort)()
+        await self.send_upload_error(upload_id, error)
+
+    async def send_upload_error(self, upload_id, error):
+        await self.send(text_data=json.dumps({"type": "upload_error", "upload_id": upload_id, "message": error}))
+
+    def get_recipient_ids(self):
+        return [user_id for user_id in self.participant_names if user_id != self.user.id]
+
+    async def mark_read(self, message_id):
+        """
+        Mark the room read up to the given message and let the other participants know.
+        """
+        message = self.get_delivered_message(message_id) or await self.get_message(message_id)
+        if message is None or not await db_sync_to_async(UnreadCounter.mark_read)(self.room_name, self.user.id, message):
+            await self.send(text_data=json.dumps({"type": "error", "message": "Message not found"}))
+            return
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {"type": "read.receipt", "user_id": self.user.id, "message_id": message_id},
         )
 
-    async def chat_audio(self, event):
-        audio_bytes = event["audio"]
-        sender_id = event["sender_id"]
-        username = event["username"]
-        text = event["text"]
-
+    async def read_receipt(self, event):
         await self.send(
             text_data=json.dumps(
-                {
-                    "type": "audio",
-                    "audio": audio_bytes,
-                    "text": text,
-                    "sender_id": sender_id,
-                    "username": username,
-                    "timestamp": datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
-                }
+                {"type": "read_receipt", "user_id": event["user_id"], "message_id": event["message_id"]}
             )
         )
 
-    @database_sync_to_async
-    def get_chat_object(self, room_name):
-        return Chats.objects.filter(chat_name=room_name).first()
-
-    def get_chat_history(self, room_name):
-        return Livechat.objects.filter(room_name=room_name)
-
-    @database_sync_to_async
-    def get_username(self, sender_id):
-        user = CustomUser.objects.filter(id=sender_id).first()
-        if user:
-            return f"{user.first_name} {user.last_name}"
-        return None
-
-    @database_sync_to_async
-    def get_chat_participants(self):
-        return self.chat.users_id.all()
+    def get_delivered_message(self, message_id):
+        """
+        The last message delivered to this socket may still be waiting in the write-behind queue,
+        so it is rebuilt from its event instead of being loaded from Mongo.
+        """
+        if self.last_delivered is None or self.last_delivered["id"] != message_id:
+            return None
+        send_at = datetime.datetime.fromisoformat(self.last_delivered["send_at"])
+        return Livechat(id=ObjectId(message_id), room_name=self.room_name, send_at=send_at)
+
+    @db_sync_to_async
+    def get_message(self, message_id):
+        try:
+            return Livechat.objects(id=ObjectId(message_id)).only("room_name", "send_at").first()
+        except (InvalidId, TypeError):
+            return None
+
+    async def chat_envelope(self, event):
+        self.last_delivered = event
+        await self.send(text_data=event["text"])
+
+    async def chat_update(self, event):
+        await self.send(text_data=event["text"])
+
+    @db_sync_to_async
+    def is_chat_member(self):
+        return Chats.is_member(self.room_name, self.user.id)
+
+    @db_sync_to_async
+    def get_chat_history(self, room_name, before=None):
+        return Livechat.get_history(room_name, before=before, limit=HISTORY_PAGE_SIZE + 1)
+
+    @db_sync_to_async
+    def get_usernames(self, user_ids):
+        return get_display_names(user_ids)
+
+    @db_sync_to_async
+    def get_participant_names(self):
+        """
+        Names of the chat participants, loaded once per connection through the shared display name cache.
+        """
+        return get_display_names(list(Chats.get_participants(self.room_name).values_list("id", flat=True)))
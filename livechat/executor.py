@@ -0,0 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+db_executor = ThreadPoolExecutor(max_workers=settings.CHAT_DB_EXECUTOR_WORKERS, thread_name_prefix="chat-db")
+
+
+def db_sync_to_async(func):
+    """
+    database_sync_to_async that runs on a dedicated pool of CHAT_DB_EXECUTOR_WORKERS threads.
+
+    The default thread-sensitive mode runs every call of the process on one shared thread,
+    so one slow Mongo query would delay the database calls of all other sockets.
+    """
+    return DatabaseSyncToAsync(func, thread_sensitive=False, executor=db_executor)
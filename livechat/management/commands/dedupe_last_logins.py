@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from mongoengine.connection import get_db
+
+from livechat.models import LastLogin
+
+
+class Command(BaseCommand):
+    help = "Remove duplicate LastLogin documents, keeping the latest visit, and build the unique index."
+
+    def handle(self, *args, **options):
+        # LastLogin._get_collection() would try to build the unique index before the duplicates are gone
+        collection = get_db()[LastLogin._get_collection_name()]
+        duplicate_ids = []
+        for group in collection.aggregate(
+            [
+                {"$sort": {"last_seen": -1}},
+                {"$group": {"_id": {"room_name": "$room_name", "user_id": "$user_id"}, "ids": {"$push": "$_id"}}},
+                {"$match": {"ids.1": {"$exists": True}}},
+            ],
+            allowDiskUse=True,
+        ):
+            duplicate_ids.extend(group["ids"][1:])
+
+        if duplicate_ids:
+            collection.delete_many({"_id": {"$in": duplicate_ids}})
+        LastLogin.ensure_indexes()
+        self.stdout.write(f"Removed {len(duplicate_ids)} duplicate last login documents.")
@@ -0,0 +1,38 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from livechat.models import Chats
+
+
+class Command(BaseCommand):
+    help = "Fill participants_key for direct chats created before it existed."
+
+    def handle(self, *args, **options):
+        participants = defaultdict(set)
+        for chat_id, user_id in Chats.users_id.through.objects.filter(
+            chats__participants_key__isnull=True
+        ).values_list("chats_id", "customuser_id"):
+            participants[chat_id].add(user_id)
+
+        taken_keys = set(Chats.objects.filter(participants_key__isnull=False).values_list("participants_key", flat=True))
+        chats, duplicates = [], []
+        for chat_id in sorted(participants):
+            user_ids = sorted(participants[chat_id])
+            if len(user_ids) > 2:
+                continue
+            key = Chats.get_participants_key(user_ids[0], user_ids[-1])
+            if key in taken_keys:
+                duplicates.append(chat_id)
+                continue
+            taken_keys.add(key)
+            chats.append(Chats(id=chat_id, participants_key=key))
+
+        with transaction.atomic():
+            Chats.objects.bulk_update(chats, ["participants_key"], batch_size=1000)
+        self.stdout.write(f"Set participants key for {len(chats)} chats.")
+        if duplicates:
+            self.stderr.write(
+                f"Chats {', '.join(map(str, duplicates))} duplicate an older chat of the same users and were left without a key."
+            )
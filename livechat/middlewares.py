@@ -1,32 +1,23 @@
 from urllib.parse import parse_qs
 
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.tokens import AccessToken, TokenError
-from users.models import CustomUser
+from users.authentication import authenticate_token
 
-
-@database_sync_to_async
-def get_user(user_id):
-    try:
-        return CustomUser.objects.get(id=user_id)
-    except CustomUser.DoesNotExist:
-        return AnonymousUser()
+from .executor import db_sync_to_async
 
 
 class WebSocketJWTAuthMiddleware:
+    """
+    Sets scope["user"] from the `token` query parameter. Connections without a token are
+    anonymous without touching the cache or the database, valid tokens get a cached principal.
+    """
 
     def __init__(self, app):
         self.app = app
 
     async def __call__(self, scope, receive, send):
-        parsed_query_string = parse_qs(scope["query_string"])
-        token = parsed_query_string.get(b"token")[0].decode("utf-8")
-
-        try:
-            access_token = AccessToken(token)
-            scope["user"] = await get_user(access_token["user_id"])
-        except TokenError:
-            scope["user"] = AnonymousUser()
+        token = parse_qs(scope["query_string"]).get(b"token")
+        principal = await db_sync_to_async(authenticate_token)(token[0].decode()) if token else None
+        scope["user"] = principal or AnonymousUser()
 
         return await self.app(scope, receive, send)
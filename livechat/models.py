@@ -1,18 +1,94 @@
 import mongoengine
+from bson import ObjectId
+from collections import defaultdict
 from datetime import datetime
-from django.db import models
+from io import BytesIO
+from django.db import models, transaction
+from gridfs import GridFS
+from mongoengine.connection import get_db
+from PIL import Image, ImageOps
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from users.models import CustomUser
 
 
 class Chats(models.Model):
-    chat_name = models.CharField(max_length=255)
+    chat_name = models.CharField(max_length=255, db_index=True)
     users_id = models.ManyToManyField("users.CustomUser", related_name="chats")
+    participants_key = models.CharField(max_length=64, unique=True, null=True, editable=False)
 
     class Meta:
         db_table = "chats"
 
+    @classmethod
+    def is_member(cls, chat_name, user_id):
+        """
+        Access check shared by the room page, media and the chat consumer:
+        a single EXISTS query on the participants table, no participants are loaded.
+        """
+        if user_id is None:
+            return False
+        return cls.users_id.through.objects.filter(chats__chat_name=chat_name, customuser_id=user_id).exists()
+
+    @staticmethod
+    def get_participants(chat_name):
+        return CustomUser.objects.filter(chats__chat_name=chat_name)
+
+    @staticmethod
+    def get_participants_key(first_user_id, second_user_id):
+        """
+        Direct chats are keyed by their participant ids in ascending order, so both users map to the same row.
+        """
+        first_user_id, second_user_id = sorted((first_user_id, second_user_id))
+        return f"{first_user_id}:{second_user_id}"
+
+    @classmethod
+    def get_or_create_direct(cls, sender_id, receiver_id):
+        """
+        Return (id, chat_name) of the direct chat between two users, creating it when it does not exist.
+
+        An existing chat is found with one lookup on the unique participants_key index.
+        A new chat is inserted with INSERT ... ON CONFLICT on that key, so concurrent requests
+        for the same pair resolve to a single room instead of creating duplicates.
+        """
+        key = cls.get_participants_key(sender_id, receiver_id)
+        existing_chat = cls.objects.filter(participants_key=key).values_list("id", "chat_name").first()
+        if existing_chat:
+            return existing_chat
+
+        if not CustomUser.objects.filter(pk=receiver_id).exists():
+            raise CustomUser.DoesNotExist
+
+        first_user_id, second_user_id = sorted((sender_id, receiver_id))
+        chat = cls(chat_name=f"room_{first_user_id}_{second_user_id}", participants_key=key)
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [chat],
+                update_conflicts=True,
+                unique_fields=["participants_key"],
+                update_fields=["participants_key"],
+            )
+            cls.users_id.through.objects.bulk_create(
+                [cls.users_id.through(chats_id=chat.id, customuser_id=user_id) for user_id in {sender_id, receiver_id}],
+                ignore_conflicts=True,
+            )
+        return chat.id, chat.chat_name
+
+
+HISTORY_PAGE_SIZE = 50
+MEDIA_TYPES = ("image", "video", "audio")
+DUPLICATE_KEY_ERROR = 11000
+THUMBNAIL_SIZES = {"small": 320, "large": 1280}
+THUMBNAIL_QUALITY = 80
+
 
 class Livechat(mongoengine.Document):
+    meta = {
+        "indexes": [
+            {"fields": ["room_name", "-send_at", "-id"], "name": "room_history_idx"},
+        ]
+    }
+
     sender_id = mongoengine.IntField(required=True)
     room_name = mongoengine.StringField(required=True, max_length=100)
     send_at = mongoengine.DateTimeField(default=datetime.now)
@@ -21,28 +97,267 @@ class Livechat(mongoengine.Document):
     image = mongoengine.ImageField(blank=True, null=True)
     video = mongoengine.FileField(blank=True, null=True)
     audio = mongoengine.FileField(blank=True, null=True)
+    media_size = mongoengine.IntField(null=True)
+    media_content_type = mongoengine.StringField(null=True, max_length=100)
+    thumbnails = mongoengine.DictField()
 
     @classmethod
-    def create_message(cls, sender_id, room_name, text='', image=None, video=None, audio=None):
-        message = cls(
-            sender_id=sender_id,
-            room_name=room_name,
-            text=text,
-            image=image,
-            video=video,
-            audio=audio
-        )
-        message.save()
+    def build_message(cls, sender_id, room_name, text=''):
+        """
+        A validated message that is not saved yet. The id and send_at are assigned here,
+        so the message can be broadcast before it is written (see `livechat.writer`).
+        """
+        message = cls(id=ObjectId(), sender_id=sender_id, room_name=room_name, text=text, send_at=datetime.now())
+        message.validate()
         return message
 
+    @classmethod
+    def build_media_message(cls, sender_id, room_name, media_type, grid_id, size, content_type, text=''):
+        """
+        Same as `build_message` for a file that is already stored in GridFS (see `new_media_file`).
+        """
+        message = cls.build_message(sender_id, room_name, text)
+        message.media_size = size
+        message.media_content_type = content_type
+        media = cls._fields[media_type].get_proxy_obj(key=media_type, instance=message)
+        media.grid_id = grid_id
+        setattr(message, media_type, media)
+        return message
 
-class Status(mongoengine.Document):
-    room_name = mongoengine.StringField(required=True)
-    user_id = mongoengine.IntField(required=True)
-    status = mongoengine.StringField()
+    @classmethod
+    def insert_batch(cls, entries):
+        """
+        Insert (message, recipient ids) pairs with one insert_many and add the new messages
+        to the unread counters of their recipients.
+
+        Messages are stored after they are delivered, so a recipient may have marked one as read already.
+        Such messages are not counted as unread and are stored as read.
+
+        Messages stored by a previous attempt are skipped, so a failed batch can be retried as is.
+        Their unread counts are not added again; `UnreadCounter.mark_read` recalculates them.
+        """
+        try:
+            cls._get_collection().insert_many([message.to_mongo() for message, _ in entries], ordered=False)
+            inserted = entries
+        except BulkWriteError as e:
+            duplicates = {error["index"] for error in e.details["writeErrors"] if error["code"] == DUPLICATE_KEY_ERROR}
+            if len(duplicates) != len(e.details["writeErrors"]) or e.details.get("writeConcernErrors"):
+                raise
+            inserted = [entry for index, entry in enumerate(entries) if index not in duplicates]
+
+        unread = defaultdict(list)
+        for message, recipient_ids in inserted:
+            for user_id in recipient_ids:
+                if user_id != message.sender_id:
+                    unread[message.room_name, user_id].append(message.send_at)
+        UnreadCounter.increment(unread)
+
+        read_positions = UnreadCounter.get_read_positions(unread)
+        read_ids = [
+            message.id
+            for message, recipient_ids in inserted
+            if any(
+                read_positions.get((message.room_name, user_id)) is not None
+                and read_positions[message.room_name, user_id] >= message.send_at
+                for user_id in recipient_ids
+                if user_id != message.sender_id
+            )
+        ]
+        if read_ids:
+            cls.objects(id__in=read_ids).update(set__is_read=True)
+
+    @classmethod
+    def new_media_file(cls, media_type, **kwargs):
+        """
+        GridFS file opened for writing in the collection used by the `media_type` field.
+        """
+        field = cls._fields[media_type]
+        return GridFS(get_db(field.db_alias), field.collection_name).new_file(**kwargs)
+
+    def get_media_reference(self):
+        """
+        Returns (media type, reference) of the attached media, or (None, None) for a text message.
+        Image references also list the available thumbnails, which clients show instead of the original.
+        The files are served by the `chat-media` view.
+        """
+        for media_type in MEDIA_TYPES:
+            media = getattr(self, media_type)
+            if media:
+                reference = {
+                    "id": str(media.grid_id),
+                    "size": self.media_size,
+                    "content_type": self.media_content_type,
+                }
+                if media_type == "image":
+                    reference["thumbnails"] = self.get_thumbnail_references()
+                return media_type, reference
+        return None, None
+
+    def get_thumbnail_references(self):
+        return {
+            name: {"id": str(thumbnail["id"]), "width": thumbnail["width"], "height": thumbnail["height"]}
+            for name, thumbnail in (self.thumbnails or {}).items()
+        }
+
+    def create_thumbnails(self):
+        """
+        Store WebP copies of the image bounded by THUMBNAIL_SIZES next to the original in GridFS.
+        Sizes the original already fits in are skipped, clients use the original for them.
+        """
+        original = ImageOps.exif_transpose(Image.open(self.image.get()))
+        has_alpha = "A" in original.getbands() or "transparency" in original.info
+        original = original.convert("RGBA" if has_alpha else "RGB")
+        thumbnails = {}
+        for name, max_side in THUMBNAIL_SIZES.items():
+            if max(original.size) <= max_side:
+                continue
+            thumbnail = original.copy()
+            thumbnail.thumbnail((max_side, max_side))
+            content = BytesIO()
+            thumbnail.save(content, "WEBP", quality=THUMBNAIL_QUALITY)
+            grid_in = self.new_media_file("image", filename=f"{self.id}_{name}.webp", content_type="image/webp")
+            grid_in.write(content.getvalue())
+            grid_in.close()
+            thumbnails[name] = {"id": grid_in._id, "width": thumbnail.width, "height": thumbnail.height}
+        self.thumbnails = thumbnails
+        return thumbnails
+
+    def get_media_file(self, grid_id):
+        """
+        Returns (GridOut, content type) of the attached media or of one of its thumbnails,
+        or None when `grid_id` is not a file of this message.
+        """
+        media_type, reference = self.get_media_reference()
+        if media_type is None:
+            return None
+        media = getattr(self, media_type)
+        if media.grid_id == grid_id:
+            grid_out = media.get()
+            return grid_out, reference["content_type"] or grid_out.content_type or "application/octet-stream"
+        if any(thumbnail["id"] == grid_id for thumbnail in (self.thumbnails or {}).values()):
+            field = self._fields[media_type]
+            return GridFS(get_db(field.db_alias), field.collection_name).get(grid_id), "image/webp"
+        return None
+
+    @classmethod
+    def get_history(cls, room_name, before=None, limit=HISTORY_PAGE_SIZE):
+        """
+        One page of the room history, newest first.
+        `before` is the (send_at, id) of the oldest message the client already has.
+        """
+        messages = cls.objects(room_name=room_name)
+        if before is not None:
+            send_at, message_id = before
+            messages = messages.filter(
+                mongoengine.Q(send_at__lt=send_at) | mongoengine.Q(send_at=send_at, id__lt=message_id)
+            )
+        return list(messages.order_by("-send_at", "-id").limit(limit))
 
 
 class LastLogin(mongoengine.Document):
+    """
+    The user's last visit of a room, one document per (room_name, user_id).
+    Remove duplicates left by older code before the unique index is built with
+    `python manage.py dedupe_last_logins`.
+    """
+
+    meta = {
+        "indexes": [
+            {"fields": ["room_name", "user_id"], "unique": True},
+        ]
+    }
+
     room_name = mongoengine.StringField(required=True)
     user_id = mongoengine.IntField(required=True)
     last_seen = mongoengine.DateTimeField(default=datetime.now)
+
+    @classmethod
+    def touch(cls, room_name, user_id):
+        """
+        Set the user's last visit of the room to now with a single upsert.
+        """
+        cls.objects(room_name=room_name, user_id=user_id).update_one(set__last_seen=datetime.now(), upsert=True)
+
+
+class UnreadCounter(mongoengine.Document):
+    """
+    Number of messages in the room the user has not read yet.
+    Incremented when a message is created, recalculated when the user marks messages as read.
+    """
+
+    meta = {
+        "indexes": [
+            {"fields": ["room_name", "user_id"], "unique": True},
+            "user_id",
+        ]
+    }
+
+    room_name = mongoengine.StringField(required=True)
+    user_id = mongoengine.IntField(required=True)
+    unread_count = mongoengine.IntField(default=0)
+    last_read_at = mongoengine.DateTimeField(null=True)
+
+    @classmethod
+    def increment(cls, unread):
+        """
+        Add new messages to the counters with one bulk write.
+        `unread` maps (room_name, user_id) to the send_at of the new messages. Messages at or before
+        the user's last_read_at were read before they were stored and are not counted;
+        the comparison runs in the update, so it cannot race with `mark_read`.
+        """
+        if unread:
+            cls._get_collection().bulk_write(
+                [
+                    UpdateOne(
+                        {"room_name": room_name, "user_id": user_id},
+                        [{"$set": {"unread_count": {"$add": [
+                            {"$ifNull": ["$unread_count", 0]},
+                            {"$size": {"$filter": {
+                                "input": send_at_list,
+                                "cond": {"$gt": ["$$this", {"$ifNull": ["$last_read_at", None]}]},
+                            }}},
+                        ]}}}],
+                        upsert=True,
+                    )
+                    for (room_name, user_id), send_at_list in unread.items()
+                ],
+                ordered=False,
+            )
+
+    @classmethod
+    def get_read_positions(cls, keys):
+        """
+        last_read_at of the given (room_name, user_id) counters that have one.
+        """
+        if not keys:
+            return {}
+        rooms = {room_name for room_name, _ in keys}
+        users = {user_id for _, user_id in keys}
+        counters = cls.objects(room_name__in=rooms, user_id__in=users, last_read_at__ne=None)
+        return {
+            (room_name, user_id): last_read_at
+            for room_name, user_id, last_read_at in counters.scalar("room_name", "user_id", "last_read_at")
+            if (room_name, user_id) in keys
+        }
+
+    @classmethod
+    def mark_read(cls, room_name, user_id, message):
+        """
+        Mark the messages of the other participants up to `message` as read and reset the counter
+        to the number of messages received after it. Returns False when the message is not in the room.
+        """
+        if message.room_name != room_name:
+            return False
+        from_others = Livechat.objects(room_name=room_name, sender_id__ne=user_id)
+        from_others.filter(is_read=False, send_at__lte=message.send_at).update(set__is_read=True)
+        unread_count = from_others.filter(
+            mongoengine.Q(send_at__gt=message.send_at) | mongoengine.Q(send_at=message.send_at, id__gt=message.id)
+        ).count()
+        cls.objects(room_name=room_name, user_id=user_id).update_one(
+            set__unread_count=unread_count, set__last_read_at=message.send_at, upsert=True
+        )
+        return True
+
+    @classmethod
+    def get_unread_counts(cls, user_id):
+        return dict(cls.objects(user_id=user_id).scalar("room_name", "unread_count"))
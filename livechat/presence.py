@@ -0,0 +1,65 @@
+import time
+
+import redis.asyncio as redis
+from django.conf import settings
+
+PRESENCE_TTL = 60
+HEARTBEAT_INTERVAL = 20
+OFFLINE_DELAY = 5
+
+client = redis.from_url(settings.PRESENCE_REDIS_URL)
+
+
+class Presence:
+    """
+    Online state of one chat connection, kept in Redis instead of Mongo.
+
+    Every room has a sorted set of "<user_id>:<channel_name>" members scored by their expiry time,
+    so a connection that stops sending heartbeats (e.g. a crashed worker) drops out after PRESENCE_TTL.
+    A user is online while any of their connections is in the set.
+    Leaving keeps the connection for OFFLINE_DELAY more seconds, so a quick reconnect is not reported
+    as going offline and coming back.
+    """
+
+    def __init__(self, room_name, user_id, channel_name):
+        self.key = self.get_key(room_name)
+        self.member = f"{user_id}:{channel_name}"
+
+    @staticmethod
+    def get_key(room_name):
+        return f"presence:{room_name}"
+
+    @staticmethod
+    def parse_users(members):
+        return {int(member.split(b":", 1)[0]) for member in members}
+
+    async def join(self):
+        """
+        Add the connection. Returns the users that were online in the room before it.
+        """
+        now = time.time()
+        async with client.pipeline() as pipe:
+            pipe.zremrangebyscore(self.key, "-inf", now)
+            pipe.zrange(self.key, 0, -1)
+            pipe.zadd(self.key, {self.member: now + PRESENCE_TTL})
+            pipe.expire(self.key, PRESENCE_TTL)
+            _, members, _, _ = await pipe.execute()
+        return self.parse_users(members)
+
+    async def heartbeat(self):
+        async with client.pipeline() as pipe:
+            pipe.zadd(self.key, {self.member: time.time() + PRESENCE_TTL})
+            pipe.expire(self.key, PRESENCE_TTL)
+            await pipe.execute()
+
+    async def leave(self):
+        await client.zadd(self.key, {self.member: time.time() + OFFLINE_DELAY}, xx=True)
+
+    @classmethod
+    async def get_online_users(cls, room_name):
+        key = cls.get_key(room_name)
+        async with client.pipeline() as pipe:
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zrange(key, 0, -1)
+            _, members = await pipe.execute()
+        return cls.parse_users(members)
@@ -0,0 +1,43 @@
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from bson import ObjectId
+from celery import shared_task
+from channels.layers import get_channel_layer
+from PIL import Image, UnidentifiedImageError
+
+from .models import Livechat
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def create_image_thumbnails(message_id):
+    """
+    Celery task storing WebP thumbnails of a chat image in GridFS and telling the room about them.
+    Queued by the consumer once the write-behind queue has stored the message.
+
+    Args:
+        message_id (str): The ID of the image message.
+    """
+    message = Livechat.objects(id=ObjectId(message_id)).only("room_name", "image").first()
+    if message is None:
+        logger.warning("Image message %s not found, no thumbnails created", message_id)
+        return
+    try:
+        message.create_thumbnails()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        logger.warning("Could not create thumbnails of message %s: %s", message_id, e)
+        return
+    Livechat.objects(id=message.id).update_one(set__thumbnails=message.thumbnails)
+
+    async_to_sync(get_channel_layer().group_send)(
+        f"chat_{message.room_name}",
+        {
+            "type": "chat.update",
+            "text": json.dumps(
+                {"type": "thumbnails", "id": message_id, "thumbnails": message.get_thumbnail_references()}
+            ),
+        },
+    )
@@ -0,0 +1,524 @@
+import asyncio
+import json
+from datetime import datetime
+from io import BytesIO, StringIO
+from unittest import mock
+from uuid import uuid4
+
+import mongomock
+from bson import ObjectId
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from mixer.backend.django import mixer
+from mongoengine.fields import ImageGridFsProxy
+from PIL import Image
+from pymongo.errors import AutoReconnect, BulkWriteError
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from forum.blocking import BlockingCallDetector
+from livechat.consumers import ChatConsumer
+from livechat.models import Chats, LastLogin, Livechat, UnreadCounter
+from livechat.presence import Presence
+from livechat.tasks import create_image_thumbnails
+from livechat.uploads import CHUNK_HEADER, MAX_UPLOAD_SIZE, ChunkedUpload, UploadError
+from livechat.utils import grid_file_response, parse_byte_range
+from livechat.views import ChatsViewSet, room
+from livechat.writer import MessageWriter
+from users.authentication import revoke_token_session, start_token_session
+from users.models import CustomUser
+from users.tests import TOKEN_CACHES
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.message = Livechat(id=ObjectId(), sender_id=1, room_name='room_1_2', text='Hello',
+                                send_at=datetime(2024, 5, 1, 12, 30))
+
+    def test_history_cursor_round_trip(self):
+        '''
+        Test that the cursor sent to the client points back to the same message
+        '''
+        cursor = ChatConsumer.encode_history_cursor(self.message)
+        self.assertEqual(ChatConsumer.decode_history_cursor(cursor), (self.message.send_at, self.message.id))
+
+    def test_invalid_history_cursor(self):
+        '''
+        Test that malformed cursors are rejected instead of breaking the connection
+        '''
+        for cursor in (None, {}, {'send_at': 'yesterday', 'id': str(ObjectId())},
+                       {'send_at': '2024-05-01T12:30:00', 'id': 'not-an-id'}):
+            self.assertIsNone(ChatConsumer.decode_history_cursor(cursor))
+
+    def test_mark_read_rejects_message_of_another_room(self):
+        '''
+        Test that a message id from another room cannot reset the counter
+        '''
+        self.assertFalse(UnreadCounter.mark_read('room_3_4', 3, self.message))
+
+    def test_envelope_is_encoded_by_the_sender_only(self):
+        '''
+        Test that receiving consumers forward the encoded envelope and can mark it read before it is stored
+        '''
+        envelope = ChatConsumer.build_envelope(self.message, 'John Doe')
+        self.assertEqual(envelope, {'type': 'chat', 'id': str(self.message.id), 'username': 'John Doe',
+                                    'timestamp': '05/01/2024, 12:30:00', 'sender_id': 1, 'message': 'Hello'})
+        event = {'type': 'chat.envelope', 'id': str(self.message.id), 'send_at': self.message.send_at.isoformat(),
+                 'text': json.dumps(envelope)}
+        consumer = ChatConsumer()
+        consumer.room_name = 'room_1_2'
+        consumer.send = mock.AsyncMock()
+        asyncio.run(consumer.chat_envelope(event))
+        consumer.send.assert_awaited_once_with(text_data=event['text'])
+        delivered = consumer.get_delivered_message(str(self.message.id))
+        self.assertEqual((delivered.id, delivered.send_at), (self.message.id, self.message.send_at))
+
+    def test_history_media_is_sent_as_reference(self):
+        '''
+        Test that history items carry the GridFS id of the media instead of the file content
+        '''
+        grid_id = ObjectId()
+        self.message.image = ImageGridFsProxy(grid_id=grid_id)
+        self.message.media_size = 2048
+        self.message.media_content_type = 'image/png'
+        data = ChatConsumer.serialize_history_message(self.message, {1: 'John Doe'})
+        self.assertEqual(data['image'], {'id': str(grid_id), 'size': 2048, 'content_type': 'image/png',
+                                         'thumbnails': {}})
+        self.assertEqual(data['username'], 'John Doe')
+        self.assertNotIn('message', data)
+
+
+class FakeGridOut(BytesIO):
+    def __init__(self, content):
+        super().__init__(content)
+        self._id = ObjectId()
+        self.length = len(content)
+        self.chunk_size = 4
+        self.upload_date = datetime(2024, 5, 1, 12, 30)
+
+
+class MediaStreamingTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.content = b'0123456789'
+
+    def get(self, **headers):
+        grid_out = FakeGridOut(self.content)
+        response = grid_file_response(self.factory.get('/api/livechat/media/1/', **headers), grid_out, 'video/mp4')
+        return response, grid_out
+
+    @staticmethod
+    def read_chunks(response):
+        async def read_all():
+            return [chunk async for chunk in response.streaming_content]
+
+        return asyncio.run(read_all())
+
+    def test_parse_byte_range(self):
+        '''
+        Test that single ranges are parsed and clamped, and unsupported ones are ignored
+        '''
+        self.assertEqual(parse_byte_range('bytes=2-5', 10), (2, 5))
+        self.assertEqual(parse_byte_range('bytes=2-', 10), (2, 9))
+        self.assertEqual(parse_byte_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_byte_range('bytes=5-100', 10), (5, 9))
+        self.assertIsNone(parse_byte_range('bytes=0-1,4-5', 10))
+        self.assertIsNone(parse_byte_range('items=0-1', 10))
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=10-', 10)
+
+    def test_full_response(self):
+        '''
+        Test that the whole file is streamed chunk by chunk with validators
+        '''
+        response, grid_out = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(self.read_chunks(response), [b'0123', b'4567', b'89'])
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['ETag'], f'"{grid_out._id}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range_response(self):
+        '''
+        Test that a Range request gets 206 with only the requested bytes
+        '''
+        response, _ = self.get(HTTP_RANGE='bytes=3-6')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(self.read_chunks(response)), b'3456')
+        self.assertEqual(response['Content-Range'], 'bytes 3-6/10')
+
+    def test_unsatisfiable_range(self):
+        '''
+        Test that a range past the end of the file gets 416
+        '''
+        response, _ = self.get(HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_not_modified(self):
+        '''
+        Test that a matching If-None-Match is answered without the file content
+        '''
+        grid_out = FakeGridOut(self.content)
+        request = self.factory.get('/api/livechat/media/1/', HTTP_IF_NONE_MATCH=f'"{grid_out._id}"')
+        response = grid_file_response(request, grid_out, 'video/mp4')
+        self.assertEqual(response.status_code, 304)
+
+
+class ChunkedUploadTest(TestCase):
+    def test_parse_frame(self):
+        '''
+        Test that the upload id and sequence number are read from the binary frame header
+        '''
+        upload_id = uuid4()
+        frame = CHUNK_HEADER.pack(upload_id.bytes, 7) + b'chunk'
+        self.assertEqual(ChunkedUpload.parse_frame(frame), (upload_id.hex, 7, b'chunk'))
+        with self.assertRaises(UploadError):
+            ChunkedUpload.parse_frame(frame[:CHUNK_HEADER.size])
+
+    def test_invalid_upload_start(self):
+        '''
+        Test that uploads with an unknown type, a bad size or a mismatching MIME type are refused
+        '''
+        for arguments in (('document', 'a.pdf', 'application/pdf', 10),
+                          ('video', 'a.mp4', 'video/mp4', MAX_UPLOAD_SIZE + 1),
+                          ('video', 'a.mp4', 'video/mp4', '10'),
+                          ('image', 'a.svg', 'text/html', 10)):
+            with self.assertRaises(UploadError):
+                ChunkedUpload(*arguments)
+
+    def test_image_type_is_detected_from_content(self):
+        '''
+        Test that the image MIME type comes from the file header
+        '''
+        image = BytesIO()
+        Image.new('RGB', (2, 2)).save(image, 'PNG')
+        self.assertEqual(ChunkedUpload.detect_image_type(image.getvalue()[:64]), 'image/png')
+        with self.assertRaises(UploadError):
+            ChunkedUpload.detect_image_type(b'<svg xmlns="http://www.w3.org/2000/svg"></svg>')
+
+
+class BlockingCallDetectorTest(TestCase):
+    class Event:
+        command_name = 'find'
+
+    def test_command_on_event_loop_is_reported(self):
+        '''
+        Test that a Mongo command sent from a running event loop is logged and one sent from a thread is not
+        '''
+        detector = BlockingCallDetector()
+
+        async def send_on_loop():
+            detector.started(self.Event())
+
+        with self.assertLogs('forum.blocking', level='WARNING'):
+            asyncio.run(send_on_loop())
+        with self.assertNoLogs('forum.blocking', level='WARNING'):
+            detector.started(self.Event())
+
+
+class PresenceTest(TestCase):
+    def test_users_with_several_connections_are_counted_once(self):
+        '''
+        Test that connection members are reduced to the set of online users
+        '''
+        members = [b'1:specific.abc!one', b'1:specific.abc!two', b'2:specific.def!one']
+        self.assertEqual(Presence.parse_users(members), {1, 2})
+        self.assertEqual(Presence('room_1_2', 1, 'specific.abc!one').member, '1:specific.abc!one')
+
+
+class ChatsRetrieveOrCreateTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ChatsViewSet.as_view({'post': 'retrieve_or_create'})
+        self.sender = mixer.blend(CustomUser)
+        self.receiver = mixer.blend(CustomUser)
+
+    def post(self, user, receiver_id):
+        request = self.factory.post('/api/livechat/', {'receiver_id': receiver_id}, format='json',
+                                    HTTP_AUTHORIZATION='Bearer token')
+        force_authenticate(request, user=user)
+        return self.view(request)
+
+    def test_chat_is_created_once_per_pair(self):
+        '''
+        Test that both users resolve to the same room and it has both participants
+        '''
+        response = self.post(self.sender, self.receiver.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        chat = Chats.objects.get(id=response.data['chat_id'])
+        self.assertEqual(set(chat.users_id.values_list('id', flat=True)), {self.sender.id, self.receiver.id})
+
+        reverse_response = self.post(self.receiver, self.sender.id)
+        self.assertEqual(reverse_response.data['chat_id'], chat.id)
+        self.assertEqual(reverse_response.data['chat_name'], chat.chat_name)
+        self.assertEqual(Chats.objects.count(), 1)
+
+    def test_existing_chat_is_a_single_lookup(self):
+        '''
+        Test that an existing chat is resolved with one query on the participants key
+        '''
+        chat_id, _ = Chats.get_or_create_direct(self.sender.id, self.receiver.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(Chats.get_or_create_direct(self.receiver.id, self.sender.id)[0], chat_id)
+
+    def test_concurrent_create_does_not_duplicate_chat(self):
+        '''
+        Test that a create racing with an already inserted row returns that row instead of a duplicate
+        '''
+        chat_id, _ = Chats.get_or_create_direct(self.sender.id, self.receiver.id)
+        with mock.patch('django.db.models.query.QuerySet.first', return_value=None):
+            self.assertEqual(Chats.get_or_create_direct(self.receiver.id, self.sender.id)[0], chat_id)
+        self.assertEqual(Chats.objects.count(), 1)
+        self.assertEqual(Chats.users_id.through.objects.count(), 2)
+
+    def test_invalid_receiver(self):
+        '''
+        Test that an unknown or malformed receiver id does not create a chat
+        '''
+        self.assertEqual(self.post(self.sender, 0).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.post(self.sender, 'abc').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Chats.objects.exists())
+
+
+@override_settings(CACHES=TOKEN_CACHES)
+class RoomAccessTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['tokens'].clear()
+        self.factory = RequestFactory()
+        self.member = mixer.blend(CustomUser)
+        self.other_member = mixer.blend(CustomUser)
+        self.stranger = mixer.blend(CustomUser)
+        _, self.chat_name = Chats.get_or_create_direct(self.member.id, self.other_member.id)
+
+    def get(self, user=None, token=None):
+        if user:
+            token = AccessToken.for_user(user)
+        query = {'token': str(token)} if token else {}
+        return room(self.factory.get(f'/api/livechat/room/{self.chat_name}/', query), self.chat_name)
+
+    def test_member_can_open_room(self):
+        '''
+        Test that a participant gets the room with the membership check and participants in two queries
+        once the token's user is cached
+        '''
+        token = AccessToken.for_user(self.member)
+        with self.assertNumQueries(3):
+            self.get(token=token)
+        with self.assertNumQueries(2):
+            response = self.get(token=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'participant_{self.other_member.id}')
+
+    def test_non_member_cannot_open_room(self):
+        '''
+        Test that users outside the chat, anonymous users and unknown rooms get 404
+        '''
+        self.assertEqual(self.get(self.stranger).status_code, 404)
+        self.assertEqual(self.get().status_code, 404)
+        self.assertFalse(Chats.is_member('room_0_0', self.member.id))
+
+    def test_revoked_and_inactive_tokens_cannot_open_room(self):
+        '''
+        Test that the room checks the token like a WebSocket: logged out sessions and inactive users get 404
+        '''
+        refresh = RefreshToken.for_user(self.member)
+        start_token_session(refresh)
+        revoke_token_session(refresh)
+        self.assertEqual(self.get(token=refresh.access_token).status_code, 404)
+
+        CustomUser.objects.filter(id=self.member.id).update(is_active=False)
+        self.assertEqual(self.get(self.member).status_code, 404)
+
+
+class MessageWriterTest(TestCase):
+    def setUp(self):
+        self.messages = [Livechat.build_message(1, 'room_1_2', text=f'Message {i}') for i in range(3)]
+
+    def write(self, writer):
+        async def put_all():
+            saved = [await writer.put(message, [2]) for message in self.messages]
+            return await asyncio.gather(*saved, return_exceptions=True)
+
+        return asyncio.run(put_all())
+
+    @mock.patch('livechat.writer.Livechat.insert_batch')
+    def test_queued_messages_are_written_in_one_batch(self, insert_batch):
+        '''
+        Test that messages queued together are inserted with one call and resolve to their ids
+        '''
+        self.assertEqual(self.write(MessageWriter(max_size=10)), [message.id for message in self.messages])
+        insert_batch.assert_called_once_with([(message, [2]) for message in self.messages])
+
+    @mock.patch('livechat.writer.WRITE_RETRY_DELAYS', (0, 0))
+    @mock.patch('livechat.writer.Livechat.insert_batch')
+    def test_failed_batch_is_retried(self, insert_batch):
+        '''
+        Test that a failed insert is retried and the error is reported only after the last attempt
+        '''
+        insert_batch.side_effect = [AutoReconnect(), None]
+        with self.assertLogs('livechat.writer', level='WARNING'):
+            self.assertEqual(self.write(MessageWriter(max_size=10)), [message.id for message in self.messages])
+
+        insert_batch.reset_mock(side_effect=True)
+        insert_batch.side_effect = AutoReconnect()
+        with self.assertLogs('livechat.writer', level='ERROR'):
+            results = self.write(MessageWriter(max_size=10))
+        self.assertTrue(all(isinstance(result, AutoReconnect) for result in results))
+        self.assertEqual(insert_batch.call_count, 3)
+
+    @mock.patch('livechat.models.UnreadCounter.get_read_positions', return_value={})
+    @mock.patch('livechat.models.UnreadCounter.increment')
+    @mock.patch('livechat.models.Livechat._get_collection')
+    def test_retried_batch_skips_stored_messages(self, get_collection, increment, get_read_positions):
+        '''
+        Test that messages stored by an earlier attempt are not counted as unread again
+        '''
+        get_collection.return_value.insert_many.side_effect = BulkWriteError(
+            {'writeErrors': [{'index': 0, 'code': 11000}], 'writeConcernErrors': []}
+        )
+        Livechat.insert_batch([(message, [1, 2]) for message in self.messages])
+        increment.assert_called_once_with({('room_1_2', 2): [message.send_at for message in self.messages[1:]]})
+
+    def test_message_read_before_it_is_stored(self):
+        '''
+        Test that a message marked as read before the writer stores it is not counted and is stored as read
+        '''
+        database = mongomock.MongoClient().db
+        for second, message in enumerate(self.messages):
+            message.send_at = datetime(2024, 1, 1, 12, 0, second)
+        read = self.messages[0]
+
+        with mock.patch.object(Livechat, '_get_collection', return_value=database.livechat), \
+                mock.patch.object(UnreadCounter, '_get_collection', return_value=database.unread_counter):
+            # The lobby marks the delivered message as read while it is still queued
+            UnreadCounter.mark_read('room_1_2', 2, read)
+            Livechat.insert_batch([(message, [1, 2]) for message in self.messages])
+            Livechat.insert_batch([(Livechat.build_message(2, 'room_1_2', text='Reply'), [1, 2])])
+
+            self.assertEqual(UnreadCounter.get_unread_counts(2), {'room_1_2': 2})
+            self.assertEqual(UnreadCounter.get_unread_counts(1), {'room_1_2': 1})
+            self.assertEqual(
+                [message.is_read for message in Livechat.objects(sender_id=1).order_by('send_at')],
+                [True, False, False],
+            )
+
+
+class DedupeLastLoginsTest(TestCase):
+    @mock.patch.object(LastLogin, 'ensure_indexes')
+    @mock.patch('livechat.management.commands.dedupe_last_logins.get_db')
+    def test_duplicates_are_removed_before_the_index_is_built(self, get_db, ensure_indexes):
+        '''
+        Test that all but the latest document of every (room_name, user_id) are deleted and the index is built
+        '''
+        latest, older, oldest = ObjectId(), ObjectId(), ObjectId()
+        collection = get_db.return_value.__getitem__.return_value
+        collection.aggregate.return_value = [{'_id': {'room_name': 'room_1_2', 'user_id': 1},
+                                              'ids': [latest, older, oldest]}]
+        manager = mock.Mock()
+        manager.attach_mock(collection.delete_many, 'delete_many')
+        manager.attach_mock(ensure_indexes, 'ensure_indexes')
+
+        call_command('dedupe_last_logins', stdout=StringIO())
+        self.assertEqual(manager.mock_calls, [
+            mock.call.delete_many({'_id': {'$in': [older, oldest]}}),
+            mock.call.ensure_indexes(),
+        ])
+
+
+class FakeGridIn(BytesIO):
+    def __init__(self, **kwargs):
+        super().__init__()
+        self._id = ObjectId()
+        self.kwargs = kwargs
+
+    def close(self):
+        self.content = self.getvalue()
+
+
+class ImageThumbnailTest(TestCase):
+    def create_thumbnails(self, size):
+        original = BytesIO()
+        Image.new('RGB', size).save(original, 'PNG')
+        original.seek(0)
+        message = Livechat(id=ObjectId(), sender_id=1, room_name='room_1_2', image=ImageGridFsProxy(grid_id=ObjectId()))
+        files = []
+
+        def new_media_file(media_type, **kwargs):
+            files.append(FakeGridIn(**kwargs))
+            return files[-1]
+
+        with mock.patch.object(ImageGridFsProxy, 'get', return_value=original), \
+                mock.patch.object(Livechat, 'new_media_file', side_effect=new_media_file):
+            message.create_thumbnails()
+        return message, files
+
+    def test_thumbnails_are_bounded_webp_files(self):
+        '''
+        Test that a large image gets a WebP thumbnail for every size and the reference points to them
+        '''
+        message, files = self.create_thumbnails((2000, 1000))
+        self.assertEqual([Image.open(BytesIO(file.content)).format for file in files], ['WEBP', 'WEBP'])
+        self.assertTrue(all(file.kwargs['content_type'] == 'image/webp' for file in files))
+        self.assertEqual(message.get_media_reference()[1]['thumbnails'], {
+            'small': {'id': str(files[0]._id), 'width': 320, 'height': 160},
+            'large': {'id': str(files[1]._id), 'width': 1280, 'height': 640},
+        })
+
+    def test_only_files_of_the_message_are_served(self):
+        '''
+        Test that a media URL cannot combine a message with a file of another message
+        '''
+        message, _ = self.create_thumbnails((2000, 1000))
+        message.media_content_type = 'image/png'
+        with mock.patch.object(ImageGridFsProxy, 'get') as get:
+            self.assertEqual(message.get_media_file(message.image.grid_id), (get.return_value, 'image/png'))
+        self.assertIsNone(message.get_media_file(ObjectId()))
+
+    @mock.patch('livechat.consumers.create_image_thumbnails')
+    def test_thumbnails_are_queued_after_the_message_is_stored(self, create_image_thumbnails):
+        '''
+        Test that the thumbnail task is queued only once the writer stored the image message
+        '''
+        message = Livechat(id=ObjectId(), sender_id=1, room_name='room_1_2', image=ImageGridFsProxy(grid_id=ObjectId()))
+        consumer = ChatConsumer()
+        consumer.send = mock.AsyncMock()
+
+        async def store(error=None):
+            saved = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(consumer.confirm_saved(message, saved))
+            await asyncio.sleep(0)
+            create_image_thumbnails.delay.assert_not_called()
+            if error:
+                saved.set_exception(error)
+            else:
+                saved.set_result(message.id)
+            await task
+
+        asyncio.run(store(AutoReconnect()))
+        create_image_thumbnails.delay.assert_not_called()
+        asyncio.run(store())
+        create_image_thumbnails.delay.assert_called_once_with(str(message.id))
+
+    @mock.patch('livechat.tasks.Livechat.objects')
+    def test_decompression_bomb_is_skipped(self, objects):
+        '''
+        Test that an image too large to decode safely is logged and gets no thumbnails
+        '''
+        message = objects.return_value.only.return_value.first.return_value
+        message.create_thumbnails.side_effect = Image.DecompressionBombError('Image size exceeds limit')
+        with self.assertLogs('livechat.tasks', level='WARNING'):
+            create_image_thumbnails(str(ObjectId()))
+        objects.return_value.update_one.assert_not_called()
+
+    def test_sizes_larger_than_original_are_skipped(self):
+        '''
+        Test that no thumbnail is stored for sizes the original already fits in
+        '''
+        message, files = self.create_thumbnails((800, 600))
+        self.assertEqual(list(message.thumbnails), ['small'])
+        self.assertEqual(len(files), 1)
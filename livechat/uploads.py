@@ -0,0 +1,88 @@
+import struct
+import uuid
+from io import BytesIO
+
+from PIL import Image, UnidentifiedImageError
+
+from .models import MEDIA_TYPES, Livechat
+
+CHUNK_HEADER = struct.Struct("!16sI")
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+MAX_PENDING_UPLOADS = 3
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkedUpload:
+    """
+    A chat attachment received in binary WebSocket frames and written to GridFS chunk by chunk,
+    so memory use does not depend on the file size.
+
+    Protocol:
+    - {"type": "upload_start", "media_type", "name", "content_type", "size"} -> {"type": "upload_ready", "upload_id", "chunk_size"}
+    - binary frame: 16-byte upload id, 4-byte big-endian sequence number, up to `chunk_size` bytes of the file
+      -> {"type": "upload_ack", "upload_id", "sequence"}, the next chunk is sent after the ack
+    - {"type": "upload_commit", "upload_id"} -> the message is saved and broadcast to the room
+    - {"type": "upload_abort", "upload_id"} drops the upload, so does any error ({"type": "upload_error"})
+    """
+
+    def __init__(self, media_type, filename, content_type, size):
+        if media_type not in MEDIA_TYPES:
+            raise UploadError("Unsupported media type")
+        if not isinstance(size, int) or not 0 < size <= MAX_UPLOAD_SIZE:
+            raise UploadError(f"File size must be between 1 byte and {MAX_UPLOAD_SIZE} bytes")
+        if not isinstance(content_type, str) or not content_type.startswith(f"{media_type}/"):
+            raise UploadError("Content type does not match the media type")
+
+        self.id = uuid.uuid4()
+        self.media_type = media_type
+        self.filename = str(filename or "")[:255]
+        self.content_type = content_type
+        self.size = size
+        self.received = 0
+        self.next_sequence = 0
+        self.grid_in = Livechat.new_media_file(media_type, filename=self.filename, content_type=content_type)
+
+    @staticmethod
+    def parse_frame(frame):
+        if len(frame) <= CHUNK_HEADER.size:
+            raise UploadError("Invalid upload frame")
+        upload_id, sequence = CHUNK_HEADER.unpack_from(frame)
+        return uuid.UUID(bytes=upload_id).hex, sequence, frame[CHUNK_HEADER.size:]
+
+    def write(self, sequence, chunk):
+        if sequence != self.next_sequence:
+            raise UploadError(f"Expected chunk {self.next_sequence}, got {sequence}")
+        if len(chunk) > UPLOAD_CHUNK_SIZE or self.received + len(chunk) > self.size:
+            raise UploadError("Upload is larger than declared")
+        if sequence == 0 and self.media_type == "image":
+            self.content_type = self.detect_image_type(chunk)
+            self.grid_in.content_type = self.content_type
+        self.grid_in.write(chunk)
+        self.received += len(chunk)
+        self.next_sequence += 1
+
+    @staticmethod
+    def detect_image_type(chunk):
+        """
+        Images are served back with their MIME type, so it comes from the file header, not from the client.
+        """
+        try:
+            image_format = Image.open(BytesIO(chunk)).format
+        except (UnidentifiedImageError, OSError):
+            raise UploadError("Invalid image")
+        if image_format not in Image.MIME:
+            raise UploadError("Invalid image")
+        return Image.MIME[image_format]
+
+    def commit(self):
+        if self.received != self.size:
+            raise UploadError("Upload is incomplete")
+        self.grid_in.close()
+        return self.grid_in._id
+
+    def abort(self):
+        self.grid_in.abort()
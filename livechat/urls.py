@@ -1,7 +1,9 @@
 from django.urls import path
-from livechat.views import ChatsViewSet, room
+from livechat.views import ChatsViewSet, media, room
 
 urlpatterns = [
     path("", ChatsViewSet.as_view({'post': 'retrieve_or_create'}), name="chats-create"),
-    path("room/<str:chat_name>/", room, name="room")
+    path("unread/", ChatsViewSet.as_view({'get': 'unread'}), name="chats-unread"),
+    path("room/<str:chat_name>/", room, name="room"),
+    path("media/<str:message_id>/<str:media_id>/", media, name="chat-media"),
 ]
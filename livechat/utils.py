@@ -0,0 +1,87 @@
+import calendar
+import re
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+BYTE_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+MEDIA_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single `Range: bytes=start-end` header into inclusive (start, end) offsets.
+    Returns None when the header should be ignored (other units, several ranges, bad syntax),
+    raises ValueError when the range cannot be satisfied for a file of `size` bytes.
+    """
+    match = BYTE_RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        suffix_length = int(end)
+        if suffix_length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - suffix_length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+async def iter_grid_file(grid_out, length):
+    """
+    Read `length` bytes from the current position of a GridFS file, one chunk at a time.
+    An async iterator, so ASGI streams the chunks instead of collecting the whole file first;
+    each blocking read runs in a worker thread.
+    """
+    read = sync_to_async(grid_out.read, thread_sensitive=False)
+    while length > 0:
+        chunk = await read(min(grid_out.chunk_size, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
+def grid_file_response(request, grid_out, content_type):
+    """
+    Stream a GridFS file with ETag/Last-Modified validation and single `Range` requests support.
+    GridFS files are never modified, so the file id is used as the ETag.
+    """
+    etag = quote_etag(str(grid_out._id))
+    last_modified = calendar.timegm(grid_out.upload_date.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        size = grid_out.length
+        byte_range = None
+        if "Range" in request.headers and request.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = parse_byte_range(request.headers["Range"], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+
+        start, end = byte_range or (0, size - 1)
+        grid_out.seek(start)
+        response = StreamingHttpResponse(
+            iter_grid_file(grid_out, end - start + 1),
+            status=200 if byte_range is None else 206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = end - start + 1
+        if byte_range is not None:
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = MEDIA_CACHE_CONTROL
+    return response
@@ -1,16 +1,19 @@
 import jwt
-from django.contrib.auth.models import AnonymousUser
+from bson import ObjectId
+from bson.errors import InvalidId
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, render
+from django.http import Http404, HttpResponse
+from django.shortcuts import render
+from django.views.decorators.http import require_safe
 from rest_framework import status, viewsets
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import AccessToken
 
 from forum.settings import SECRET_KEY
+from users.authentication import authenticate_token
 from users.models import CustomUser
-from .models import Chats
+from .models import Chats, Livechat, UnreadCounter
+from .utils import grid_file_response
 
 
 def encode_jwt(id, first_name, last_name):
@@ -18,35 +21,24 @@ def encode_jwt(id, first_name, last_name):
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
 
-def get_user(user_id):
-    try:
-        return CustomUser.objects.get(id=user_id)
-    except CustomUser.DoesNotExist:
-        return AnonymousUser()
-
-
 class ChatsViewSet(viewsets.ViewSet):
+    permission_classes = (IsAuthenticated,)
+
     def retrieve_or_create(self, request):
 
         sender_id = request.user.id
         sender_jwt_token = request.META.get('HTTP_AUTHORIZATION').split()[1]
 
-        receiver_id = request.data.get('receiver_id')
+        try:
+            receiver_id = int(request.data.get('receiver_id'))
+        except (TypeError, ValueError):
+            return Response({'receiver_id': 'A valid user id is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        existing_chat = Chats.objects.filter(users_id=sender_id).filter(users_id=receiver_id).first()
-        if existing_chat:
-            chat_id = existing_chat.id
-            chat_name = existing_chat.chat_name
+        try:
+            chat_id, chat_name = Chats.get_or_create_direct(sender_id, receiver_id)
+        except CustomUser.DoesNotExist:
+            raise Http404
 
-        else:
-            sender = get_object_or_404(CustomUser, pk=sender_id)
-            receiver = get_object_or_404(CustomUser, pk=receiver_id)
-
-            chat = Chats.objects.create(chat_name=f"room_{sender_id}_{receiver_id}")
-            chat_name = chat.chat_name
-            chat.users_id.add(sender)
-            chat.users_id.add(receiver)
-            chat_id = chat.id
         current_site = get_current_site(request).domain
         chat_url = f"{current_site}/api/livechat/room/{chat_name}/?token={sender_jwt_token}"
 
@@ -58,23 +50,68 @@ class ChatsViewSet(viewsets.ViewSet):
 
         return Response(response_data, status=status.HTTP_200_OK)
 
+    def unread(self, request):
+        """
+        Number of unread messages in every chat of the authenticated user.
+        """
+        chats = Chats.objects.filter(users_id=request.user.id).values_list("id", "chat_name")
+        unread_counts = UnreadCounter.get_unread_counts(request.user.id)
+        response_data = [
+            {"chat_id": chat_id, "chat_name": chat_name, "unread_count": unread_counts.get(chat_name, 0)}
+            for chat_id, chat_name in chats
+        ]
+        return Response(response_data, status=status.HTTP_200_OK)
 
-def room(request, chat_name):
-    token = request.GET.get('token')
-    chat = get_object_or_404(Chats, chat_name=chat_name)
-    try:
-        access_token = AccessToken(token)
-        user = get_user(access_token["user_id"])
-    except TokenError:
-        user = AnonymousUser()
 
-    if user not in chat.users_id.all():
+def room(request, chat_name):
+    user_id = get_token_user_id(request)
+    if not Chats.is_member(chat_name, user_id):
         return HttpResponse(status=404)
 
+    participants = list(Chats.get_participants(chat_name).only('id', 'first_name', 'last_name'))
+    user = next(participant for participant in participants if participant.id == user_id)
+
     return render(request, 'livechat/lobby.html', {
-        'participants': chat.users_id.all(),
+        'participants': participants,
         'chat_name': chat_name,
-        'token': token,
+        'token': request.GET.get('token'),
         'username': f'{user.first_name} {user.last_name}',
         'sender_id': f'{user.id}',
     })
+
+
+def get_token_user_id(request):
+    """
+    Id of the user from the access token in the Authorization header or the `token` query parameter.
+    Media are loaded by <img>/<video> tags, which cannot send headers.
+    The token is checked like a WebSocket token: revoked sessions and inactive users get None.
+    """
+    authorization = request.headers.get("Authorization", "").split()
+    token = authorization[1] if len(authorization) == 2 else request.GET.get("token")
+    if not token:
+        return None
+    principal = authenticate_token(token)
+    return principal.id if principal is not None else None
+
+
+@require_safe
+def media(request, message_id, media_id):
+    """
+    Stream a chat attachment or one of its thumbnails from GridFS. The URL carries the message id,
+    so the message is loaded by its primary key. Only participants of the chat the message was sent to
+    can read it, everybody else gets 404.
+    """
+    user_id = get_token_user_id(request)
+    try:
+        message_id, grid_id = ObjectId(message_id), ObjectId(media_id)
+    except InvalidId:
+        raise Http404
+    message = Livechat.objects(id=message_id).exclude("text").first()
+    if message is None or not Chats.is_member(message.room_name, user_id):
+        raise Http404
+    media_file = message.get_media_file(grid_id)
+    if media_file is None:
+        raise Http404
+
+    grid_out, content_type = media_file
+    return grid_file_response(request, grid_out, content_type)
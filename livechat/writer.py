@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+from .executor import db_sync_to_async
+from .models import Livechat
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = 100
+WRITE_RETRY_DELAYS = (0.1, 0.5, 2, 5)
+
+
+class MessageWriter:
+    """
+    Write-behind persistence of chat messages, so delivery does not wait for Mongo.
+
+    The consumer broadcasts a message built with `Livechat.build_message` and then queues it here.
+    One task per process drains the queue and writes everything queued so far with one insert_many,
+    retrying failed batches with WRITE_RETRY_DELAYS. The queue holds at most CHAT_WRITE_QUEUE_SIZE
+    messages; when Mongo falls behind, `put` waits, which slows down the senders instead of using
+    unbounded memory. Messages still in the queue are lost if the process dies.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or settings.CHAT_WRITE_QUEUE_SIZE
+        self.queue = None
+        self.task = None
+
+    async def put(self, message, recipient_ids):
+        """
+        Queue a message for writing. Returns a future that resolves to the message id once it is stored,
+        or raises the database error when all attempts failed.
+        """
+        if self.task is None or self.task.done():
+            self.queue = self.queue or asyncio.Queue(self.max_size)
+            self.task = asyncio.create_task(self.run())
+        saved = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, recipient_ids, saved))
+        return saved
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self.write(batch)
+
+    async def write(self, batch):
+        entries = [(message, recipient_ids) for message, recipient_ids, _ in batch]
+        for attempt, delay in enumerate((*WRITE_RETRY_DELAYS, None), start=1):
+            try:
+                await db_sync_to_async(Livechat.insert_batch)(entries)
+            except PyMongoError as e:
+                if delay is None:
+                    logger.error("Dropped %d chat messages after %d attempts: %s", len(batch), attempt, e)
+                    for _, _, saved in batch:
+                        if not saved.done():
+                            saved.set_exception(e)
+                    return
+                logger.warning("Writing %d chat messages failed, retrying in %ss: %s", len(batch), delay, e)
+                await asyncio.sleep(delay)
+            else:
+                for message, _, saved in batch:
+                    if not saved.done():
+                        saved.set_result(message.id)
+                return
+
+
+message_writer = MessageWriter()
@@ -60,6 +60,25 @@ class ProjectNotification(mongoengine.Document):
         notification.save()
         return notification
 
+    @classmethod
+    def create_notifications(cls, recipient_type, recipient_ids, project_id, type_of_notification, text):
+        """
+        Bulk version of create_notification: inserts one notification per recipient with a single insert_many.
+        """
+        notifications = [
+            cls(
+                recipient_type=recipient_type,
+                recipient_id=recipient_id,
+                project_id=project_id,
+                type_of_notification=type_of_notification,
+                text=text
+            )
+            for recipient_id in recipient_ids
+        ]
+        if notifications:
+            cls.objects.insert(notifications, load_bulk=False)
+        return notifications
+
     @staticmethod
     def get_unread_notifications(recipient_id, is_read=False):
         notifications = ProjectNotification.objects.filter(recipient_id=recipient_id, is_read=is_read).order_by(
@@ -1,17 +1,19 @@
 from django.contrib.sites.shortcuts import get_current_site
+from forum.cache import invalidate_cache_namespace
 from forum.middleware import get_current_request
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver, Signal
+from django.utils import timezone
 
 from investors.models import Investor
-from projects.models import Project
-from startups.models import Startup
-from .tasks import send_for_moderation, project_updating, project_subscription, project_creation_notification
+from projects.models import Location, Project
+from startups.models import Industry, Startup
+from .tasks import send_for_moderation, project_updating_fan_out, project_subscription, project_creation_notification
 from .utils import Util
 
 project_updated_signal = Signal()
 project_subscription_signal = Signal()
-project_updated_interests_signal = Signal()
 project_created_signal = Signal()
 
 
@@ -29,14 +31,70 @@ def profile_created_or_updated(sender, instance, created, **kwargs):
     send_for_moderation.delay(model_name, data_id, domain)
 
 
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Location)
+def project_listing_changed(sender, instance, **kwargs):
+    """
+    Signal handler to drop cached public project responses once the change is committed.
+    """
+    transaction.on_commit(lambda: invalidate_cache_namespace("projects"))
+
+
+@receiver(m2m_changed, sender=Project.subscribers.through)
+@receiver(m2m_changed, sender=Project.investors.through)
+def project_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Signal handler to bump Project.updated_at when subscribers or investors change,
+    since they are part of the project representation and its ETag.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    project_ids = pk_set if reverse else {instance.pk}
+    if not project_ids:
+        return
+    Project.objects.filter(id__in=project_ids).update(updated_at=timezone.now())
+    transaction.on_commit(lambda: invalidate_cache_namespace("projects"))
+
+
+@receiver(post_save, sender=Startup)
+@receiver(post_save, sender=Industry)
+def startup_listing_changed(sender, instance, **kwargs):
+    """
+    Signal handler to drop cached public startup responses once the change is committed.
+    Industry names are shown in both listings.
+    """
+    transaction.on_commit(lambda: invalidate_cache_namespace("startups"))
+    if sender is Industry:
+        transaction.on_commit(lambda: invalidate_cache_namespace("projects"))
+
+
+@receiver(post_save, sender=Industry)
+@receiver(post_save, sender=Location)
+def related_name_changed(sender, instance, created, **kwargs):
+    """
+    Signal handler to bump updated_at of the profiles that show the industry or location name,
+    so their ETags change when it is renamed.
+    """
+    if created:
+        return
+    now = timezone.now()
+    if sender is Location:
+        Project.objects.filter(location=instance).update(updated_at=now)
+        return
+    Project.objects.filter(industry=instance).update(updated_at=now)
+    Startup.objects.filter(industries=instance).update(updated_at=now)
+    Investor.objects.filter(interests=instance).update(updated_at=now)
+
+
 @receiver(project_updated_signal)
-def project_updated_receiver(sender, investor_id, project_id, **kwargs):
+def project_updated_receiver(sender, project_id, **kwargs):
     """
-    Signal handler to perform actions when a project updated.
+    Signal handler to notify subscribers and investors interested in the project's industry
+    when a project is updated. All of them are notified by a single task.
     """
     request = get_current_request()
     current_site = get_current_site(request).domain if request else "localhost:8000/"
-    project_updating.delay(investor_id, project_id, current_site)
+    transaction.on_commit(lambda: project_updating_fan_out.delay(project_id, current_site))
 
 
 @receiver(project_subscription_signal)
@@ -49,21 +107,6 @@ def project_subscription_receiver(sender, project_id, subscriber_id, **kwargs):
     project_subscription.delay(project_id, subscriber_id, current_site)
 
 
-@receiver(project_updated_interests_signal)
-def project_updated_interests_receiver(sender, project_id, **kwargs):
-    """
-    Signal handler to perform actions when a project is updated and investor's interests match project's industry.
-    """
-    request = get_current_request()
-    current_site = get_current_site(request).domain if request else "localhost:8000/"
-
-    project = Project.objects.get(id=project_id)
-    interested_investors = Investor.objects.filter(interests__name=project.industry.name)
-
-    for investor in interested_investors:
-        project_updating.delay(investor.id, project_id, current_site)
-
-
 @receiver(project_created_signal)
 def project_created_receiver(sender, project_id, **kwargs):
     """
@@ -9,17 +9,19 @@ from projects.models import Project
 from startups.models import Startup
 from users.models import CustomUser
 from .models import ProjectNotification, Notification
-from .utils import Util, get_serializer, get_model_by_name
+from .utils import Util, get_project_update_recipients, get_serializer, get_model_by_name
 
 
 @shared_task(bind=True)
-def project_updating(self, investor_id, project_id, domain):
+def project_updating_fan_out(self, project_id, domain):
     """
-    Celery task for notifying an investor about updates on a project.
+    Celery task for notifying all investors about updates on a project.
+
+    Subscribers and investors interested in the project's industry are loaded with one query and deduplicated,
+    their notifications are written with one insert and the emails are sent over one SMTP connection.
 
     Args:
         self: The task instance.
-        investor_id (int): The ID of the investor to notify.
         project_id (int): The ID of the project being updated.
         domain (str): The domain name used to construct links in the notification email.
 
@@ -27,17 +29,17 @@ def project_updating(self, investor_id, project_id, domain):
         str: A message indicating the completion of the task.
     """
     project = Project.objects.get(id=project_id)
-    investor = Investor.objects.get(id=investor_id)
-    user = CustomUser.objects.get(id=investor.user_id)
-    notification = ProjectNotification.create_notification(recipient_type="investor", recipient_id=user.id,
-                                                    project_id=project_id, type_of_notification="project_updating",
-                                                    text=f"Project {project.project_name} has been updated", )
+    recipients = get_project_update_recipients(project)
+    ProjectNotification.create_notifications(recipient_type="investor", recipient_ids=list(recipients),
+                                             project_id=project_id, type_of_notification="project_updating",
+                                             text=f"Project {project.project_name} has been updated", )
 
     link = f"http://{domain}/api/projects/{project.id}"
-    sent_data = {"email_subject": "Project Updated",
-                 "email_body": f"Hello {user.first_name}!\n" + f"The project {project.project_name} has been updated.\n" + f"Link to the project: {link}",
-                 "to_email": investor.contact_email}
-    Util.send_email(sent_data)
+    sent_data = [{"email_subject": "Project Updated",
+                  "email_body": f"Hello {first_name}!\n" + f"The project {project.project_name} has been updated.\n" + f"Link to the project: {link}",
+                  "to_email": contact_email}
+                 for first_name, contact_email in recipients.values()]
+    Util.send_emails(sent_data)
     return "Project updating task completed"
 
 
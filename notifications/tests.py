@@ -1,3 +1,55 @@
+from django.core import mail
 from django.test import TestCase
+from mixer.backend.django import mixer
 
-# Create your tests here.
+from investors.models import Investor
+from projects.models import Project
+from startups.models import Industry, Startup
+from users.models import CustomUser
+from .utils import Util, get_project_update_recipients
+
+
+class ProjectUpdateRecipientsTest(TestCase):
+    def setUp(self):
+        self.industry = mixer.blend(Industry, name='Fintech')
+        self.project = mixer.blend(Project, startup=mixer.blend(Startup), industry=self.industry)
+        self.subscriber = mixer.blend(Investor, user=mixer.blend(CustomUser), is_active=True)
+        self.interested = mixer.blend(Investor, user=mixer.blend(CustomUser), is_active=True)
+        self.both = mixer.blend(Investor, user=mixer.blend(CustomUser), is_active=True)
+        self.inactive = mixer.blend(Investor, user=mixer.blend(CustomUser), is_active=False)
+        self.unrelated = mixer.blend(Investor, user=mixer.blend(CustomUser), is_active=True)
+        self.project.subscribers.add(self.subscriber, self.both, self.inactive)
+        for investor in (self.interested, self.both):
+            investor.interests.add(self.industry)
+
+    def test_recipients_are_loaded_once_and_deduplicated(self):
+        '''
+        Test that subscribers and interested investors are merged in one query, each user once
+        '''
+        with self.assertNumQueries(1):
+            recipients = get_project_update_recipients(self.project)
+        self.assertEqual(
+            recipients,
+            {
+                investor.user_id: (investor.user.first_name, investor.contact_email)
+                for investor in (self.subscriber, self.interested, self.both)
+            }
+        )
+
+    def test_project_without_industry(self):
+        '''
+        Test that only subscribers are notified when the project has no industry
+        '''
+        self.project.industry = None
+        self.assertEqual(set(get_project_update_recipients(self.project)), {self.subscriber.user_id, self.both.user_id})
+
+
+class SendEmailsTest(TestCase):
+    def test_send_emails_in_batches(self):
+        '''
+        Test that every message is sent when they are split into several batches
+        '''
+        data = [{'email_subject': 'Subject', 'email_body': 'Body', 'to_email': f'investor{i}@example.com'}
+                for i in range(5)]
+        self.assertEqual(Util.send_emails(data, batch_size=2), 5)
+        self.assertEqual([message.to for message in mail.outbox], [[item['to_email']] for item in data])
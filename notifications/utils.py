@@ -1,9 +1,11 @@
 import os
 
 from django.apps import apps
-from django.core.mail import send_mail, EmailMultiAlternatives
+from django.core.mail import send_mail, EmailMessage, EmailMultiAlternatives, get_connection
+from django.db.models import Q
 from django.template.loader import render_to_string
 
+from investors.models import Investor
 from investors.serializers import InvestorSerializer
 from projects.serializers import ProjectSerializer
 from startups.serializers import StartupSerializer
@@ -25,6 +27,20 @@ class Util:
         email.attach_alternative(html_content, "text/html")
         email.send()
 
+    @staticmethod
+    def send_emails(data_list, batch_size=100):
+        """
+        Send plain emails over one SMTP connection, `batch_size` messages per send_messages call.
+        """
+        messages = [EmailMessage(subject=data['email_subject'], body=data['email_body'],
+                                 from_email=os.environ.get('EMAIL_HOST_USER'), to=[data['to_email']])
+                    for data in data_list]
+        sent = 0
+        with get_connection() as connection:
+            for start in range(0, len(messages), batch_size):
+                sent += connection.send_messages(messages[start:start + batch_size]) or 0
+        return sent
+
 
 def get_serializer(model_name, instance):
     """
@@ -48,3 +64,20 @@ def get_model_by_name(model_name):
         if model.__name__ == model_name:
             return model
     raise LookupError(f"Model '{model_name}' not found.")
+
+
+def get_project_update_recipients(project):
+    """
+    Active investors subscribed to the project or interested in its industry, loaded with one query.
+    An investor matching both ways, or a user with several investor profiles, is returned once.
+    """
+    condition = Q(subscribed_projects=project)
+    if project.industry_id is not None:
+        condition |= Q(interests=project.industry_id)
+    recipients = {}
+    rows = Investor.objects.filter(condition, is_active=True).values_list(
+        "user_id", "user__first_name", "contact_email"
+    ).distinct().order_by("user_id")
+    for user_id, first_name, contact_email in rows:
+        recipients.setdefault(user_id, (first_name, contact_email))
+    return recipients
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from projects.models import Investment, InvestmentTotal
+
+
+class Command(BaseCommand):
+    help = "Rebuild the InvestmentTotal rollup from the Investment ledger and verify it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="Only compare the rollup with the ledger, do not rebuild it.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify_only"]:
+            with transaction.atomic():
+                rebuilt = self.rebuild()
+            self.stdout.write(f"Rebuilt {rebuilt} investment totals.")
+
+        mismatches = self.verify()
+        if mismatches:
+            for investor_id, project_id, expected, actual in mismatches:
+                self.stderr.write(
+                    f"Investor {investor_id}, project {project_id}: ledger {expected}, rollup {actual}"
+                )
+            raise CommandError(f"{len(mismatches)} investment totals do not match the ledger.")
+        self.stdout.write(self.style.SUCCESS("Investment totals match the ledger."))
+
+    @staticmethod
+    def get_ledger_totals():
+        totals = Investment.objects.values("investor_id", "project_id").annotate(
+            total_investment=Sum("amount_invested")
+        )
+        return {
+            (total["investor_id"], total["project_id"]): total["total_investment"] for total in totals
+        }
+
+    def rebuild(self):
+        InvestmentTotal.objects.all().delete()
+        totals = [
+            InvestmentTotal(investor_id=investor_id, project_id=project_id, total_investment=total)
+            for (investor_id, project_id), total in self.get_ledger_totals().items()
+        ]
+        InvestmentTotal.objects.bulk_create(totals)
+        return len(totals)
+
+    def verify(self):
+        ledger = self.get_ledger_totals()
+        rollup = {
+            (investor_id, project_id): total
+            for investor_id, project_id, total in InvestmentTotal.objects.values_list(
+                "investor_id", "project_id", "total_investment"
+            )
+        }
+        mismatches = []
+        for key in ledger.keys() | rollup.keys():
+            expected, actual = ledger.get(key, 0), rollup.get(key, 0)
+            if expected != actual:
+                mismatches.append((*key, expected, actual))
+        return sorted(mismatches)
@@ -1,6 +1,8 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import models, transaction
 from django.db.models.functions import Now
-from startups.models import Industry, Startup
+from startups.models import SEARCH_CONFIG, Industry, Startup
 
 
 class Location(models.Model):
@@ -13,6 +15,18 @@ class Location(models.Model):
         db_table = "locations"
 
 
+def project_search_vector():
+    """
+    Weighted full-text vector over name, goals and description.
+    The same expression is indexed in Project.Meta, queries must use it to hit the GIN index.
+    """
+    return (
+        SearchVector("project_name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("goals", weight="B", config=SEARCH_CONFIG)
+        + SearchVector("description", weight="C", config=SEARCH_CONFIG)
+    )
+
+
 class Project(models.Model):
     STATUS_CHOICES = [
         ("pending", "Pending"),
@@ -64,6 +78,10 @@ class Project(models.Model):
     class Meta:
         db_table = "projects"
         app_label = "projects"
+        indexes = [
+            models.Index(fields=["-registration_date", "-id"], name="projects_registration_id_idx"),
+            GinIndex(project_search_vector(), name="projects_search_idx"),
+        ]
 
 
 class Investment(models.Model):
@@ -71,3 +89,89 @@ class Investment(models.Model):
     project = models.ForeignKey("projects.Project", on_delete=models.CASCADE)
     amount_invested = models.DecimalField(max_digits=10, decimal_places=2)
     investment_date = models.DateTimeField(db_default=Now())
+
+    @classmethod
+    def create_investment(cls, investor, project, amount_invested):
+        """
+        Create an investment and add it to the investor's InvestmentTotal for the project
+        in the same transaction, so the rollup never drifts from the ledger.
+        """
+        with transaction.atomic():
+            investment = cls.objects.create(
+                investor=investor, project=project, amount_invested=amount_invested
+            )
+            InvestmentTotal.add_investment(investment)
+        return investment
+
+    @classmethod
+    def create_investments(cls, investments):
+        """
+        Bulk version of create_investment: inserts all investments with one query
+        and adds them to their InvestmentTotal rows in the same transaction.
+        """
+        with transaction.atomic():
+            investments = cls.objects.bulk_create(investments)
+            InvestmentTotal.add_investments(investments)
+        return investments
+
+
+class InvestmentTotal(models.Model):
+    """
+    Rollup of Investment.amount_invested per (investor, project).
+    Read it instead of aggregating the Investment history.
+    Rebuild/verify it with `python manage.py rebuild_investment_totals`.
+    """
+
+    investor = models.ForeignKey("investors.Investor", on_delete=models.CASCADE)
+    project = models.ForeignKey("projects.Project", on_delete=models.CASCADE)
+    total_investment = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = "investment_totals"
+        constraints = [
+            models.UniqueConstraint(fields=["investor", "project"], name="unique_investment_total"),
+        ]
+
+    @classmethod
+    def add_investment(cls, investment):
+        """
+        Add an investment to its rollup row. Must be called inside a transaction,
+        the row stays locked until it is committed.
+        """
+        total, _ = cls.objects.select_for_update().get_or_create(
+            investor_id=investment.investor_id, project_id=investment.project_id
+        )
+        total.total_investment += investment.amount_invested
+        total.save(update_fields=["total_investment"])
+        return total
+
+    @classmethod
+    def add_investments(cls, investments):
+        """
+        Bulk version of add_investment. Returns the updated rows keyed by (investor_id, project_id).
+        """
+        keys = {(investment.investor_id, investment.project_id) for investment in investments}
+        cls.objects.bulk_create(
+            [cls(investor_id=investor_id, project_id=project_id) for investor_id, project_id in keys],
+            ignore_conflicts=True,
+        )
+        rows = cls.objects.select_for_update().filter(
+            investor_id__in={investor_id for investor_id, _ in keys},
+            project_id__in={project_id for _, project_id in keys},
+        ).order_by("id")
+        totals = {
+            (total.investor_id, total.project_id): total
+            for total in rows
+            if (total.investor_id, total.project_id) in keys
+        }
+        for investment in investments:
+            totals[(investment.investor_id, investment.project_id)].total_investment += investment.amount_invested
+        cls.objects.bulk_update(totals.values(), ["total_investment"])
+        return totals
+
+    @classmethod
+    def get_total(cls, investor, project):
+        total = cls.objects.filter(investor=investor, project=project).values_list(
+            "total_investment", flat=True
+        ).first()
+        return total if total is not None else 0
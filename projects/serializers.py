@@ -1,9 +1,9 @@
-from django.db.models import Sum
 from django.shortcuts import get_object_or_404
 from investors.models import Investor
 from rest_framework import serializers
 
-from .models import Investment, Project
+from .models import InvestmentTotal, Project
+from .utils import NOT_ENOUGH_MONEY_MESSAGE
 
 
 class ProjectSerializer(serializers.ModelSerializer):
@@ -105,13 +105,25 @@ class ProjectViewSerializer(serializers.ModelSerializer):
     def get_invested_amount(self, obj):
         request = self.context.get('request')
         if request and hasattr(request.user, 'is_investor') and request.user.is_investor:
-            user = request.user
-            investor = get_object_or_404(Investor, user=user, is_active=True)
-            investment = Investment.objects.filter(investor=investor, project=obj).aggregate(
-                total_investment=Sum('amount_invested'))
-            return investment['total_investment'] if investment['total_investment'] is not None else 0
+            return self.get_invested_amounts().get(obj.id, 0)
         return None
 
+    def get_invested_amounts(self):
+        """
+        Totals invested by the current investor, read from InvestmentTotal.
+        Loaded with one query for all serialized projects and kept in the context,
+        so a list of N projects does not cost 2N queries.
+        """
+        if 'invested_amounts' not in self.context:
+            instance = self.parent.instance if self.parent is not None else self.instance
+            projects = [instance] if isinstance(instance, Project) else instance
+            investor = get_object_or_404(Investor, user_id=self.context['request'].user.id, is_active=True)
+            totals = InvestmentTotal.objects.filter(
+                investor=investor, project_id__in=[project.id for project in projects]
+            ).values_list('project_id', 'total_investment')
+            self.context['invested_amounts'] = dict(totals)
+        return self.context['invested_amounts']
+
     @staticmethod
     def get_location(obj):
         if obj.location:
@@ -151,7 +163,7 @@ class InvestToProjectSerializer(serializers.Serializer):
         investors_money = float(investor.investment_amount)
         investment_amount = float(data['investment_amount'])
         if investment_amount > investors_money and not errors:
-            msg = "Not enough money for investing. Please - top up the balance."
+            msg = NOT_ENOUGH_MONEY_MESSAGE
             errors = True
         if errors:
             raise serializers.ValidationError({
@@ -160,3 +172,23 @@ class InvestToProjectSerializer(serializers.Serializer):
             })
         return data
 
+
+
+class BulkInvestmentItemSerializer(InvestToProjectSerializer):
+    project_id = serializers.IntegerField(required=True)
+
+    def validate(self, data):
+        return data
+
+
+class BulkInvestToProjectsSerializer(serializers.Serializer):
+    investments = BulkInvestmentItemSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_investments(self, value):
+        project_ids = [item['project_id'] for item in value]
+        if len(project_ids) != len(set(project_ids)):
+            raise serializers.ValidationError({
+                "status": "failed",
+                "message": "Each project can be listed only once."
+            })
+        return value
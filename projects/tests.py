@@ -1,8 +1,23 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from threading import Barrier, Thread
+from unittest import skipUnless
+from urllib.parse import urlparse
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from django.utils.functional import empty
 from rest_framework.test import APIRequestFactory, force_authenticate
 from rest_framework import status
+from forum.pagination import KeysetPagination
+from .utils import calculate_investment
 from .views import ProjectViewSet
-from projects.models import Project
+from projects.models import Investment, InvestmentTotal, Location, Project
+from users.authentication import PRINCIPAL_FIELDS, TokenPrincipal
 from users.models import CustomUser
 from investors.models import Investor
 from startups.models import Startup, Industry
@@ -157,3 +172,373 @@ class ProjectViewSetTest(TestCase):
         force_authenticate(request, user=self.user)
         response = self.view(request, pk=self.project.id)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProjectListPaginationTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ProjectViewSet.as_view({'get': 'list'})
+        self.user = mixer.blend(CustomUser, is_investor=False, is_startup=True)
+        self.industry = mixer.blend(Industry, name='Pagination')
+        self.startup = mixer.blend(Startup, owner=self.user, industries=self.industry)
+        registration_date = timezone.now()
+        self.projects = [
+            mixer.blend(Project, startup=self.startup, industry=self.industry, is_active=True,
+                        registration_date=registration_date - timedelta(days=index // 2))
+            for index in range(5)
+        ]
+        self.url = '/api/projects/'
+
+    def get_page(self, params):
+        request = self.factory.get(self.url, params)
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_pages_follow_cursor_without_duplicates(self):
+        '''
+        Test that following `next` walks all projects newest first, including projects with the same date
+        '''
+        names = []
+        params = {'page_size': 2}
+        while True:
+            response = self.get_page(params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names.extend(project['project_name'] for project in response.data['results'])
+            if response.data['next'] is None:
+                break
+            params = QueryDict(urlparse(response.data['next']).query)
+        expected = Project.objects.order_by('-registration_date', '-id').values_list('project_name', flat=True)
+        self.assertEqual(names, list(expected))
+
+    def test_invalid_cursor(self):
+        '''
+        Test for negative case of a cursor that was not issued by the API
+        '''
+        response = self.get_page({'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_blank_project_name_does_not_filter(self):
+        '''
+        Test that an empty `project_name` lists all projects in the default order
+        '''
+        response = self.get_page({'project_name': ' '})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = Project.objects.order_by('-registration_date', '-id').values_list('project_name', flat=True)
+        self.assertEqual([project['project_name'] for project in response.data['results']], list(expected))
+
+    def test_cursor_with_non_string_values(self):
+        '''
+        Test for negative case of a tampered cursor whose values are not strings
+        '''
+        cursor = KeysetPagination.encode_cursor(['2024-01-01', {}])
+        response = self.get_page({'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Full-text search requires PostgreSQL')
+class ProjectSearchTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ProjectViewSet.as_view({'get': 'list'})
+        self.user = mixer.blend(CustomUser, is_investor=False, is_startup=True)
+        self.startup = mixer.blend(Startup, owner=self.user)
+        self.in_description = mixer.blend(Project, startup=self.startup, is_active=True, project_name='Orchard',
+                                          goals='Grow apples', description='Solar panels for farms')
+        self.in_name = mixer.blend(Project, startup=self.startup, is_active=True, project_name='Solar roofs',
+                                   goals='Cheap energy', description='Roof tiles')
+        mixer.blend(Project, startup=self.startup, is_active=True, project_name='Bakery',
+                    goals='Bread', description='Fresh bread every day')
+
+    def test_project_name_search_is_ranked(self):
+        '''
+        Test that `project_name` searches name, goals and description and puts name matches first
+        '''
+        request = self.factory.get('/api/projects/', {'project_name': 'solar'})
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [project['project_name'] for project in response.data['results']]
+        self.assertEqual(names, [self.in_name.project_name, self.in_description.project_name])
+
+
+class ProjectInvestedAmountTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ProjectViewSet.as_view({'get': 'list'})
+        self.user = mixer.blend(CustomUser, is_investor=True, is_startup=False)
+        self.investor = mixer.blend(Investor, user=self.user, is_active=True, is_verified=True)
+        self.industry = mixer.blend(Industry, name='Invested')
+        self.startup = mixer.blend(Startup, industries=self.industry)
+        self.projects = [
+            mixer.blend(Project, startup=self.startup, industry=self.industry, is_active=True, is_verified=True)
+            for _ in range(3)
+        ]
+        Investment.create_investment(self.investor, self.projects[0], Decimal('100'))
+        Investment.create_investment(self.investor, self.projects[0], Decimal('50'))
+        Investment.create_investment(self.investor, self.projects[1], Decimal('25'))
+
+    def test_invested_amount_is_loaded_once_per_request(self):
+        '''
+        Test that the investor's totals are correct and do not cost queries per project
+        '''
+        request = self.factory.get('/api/projects/')
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(5):
+            response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        invested = {project['id']: project['invested_amount'] for project in response.data['results']}
+        self.assertEqual(invested, {self.projects[0].id: 150, self.projects[1].id: 25, self.projects[2].id: 0})
+
+    def test_token_principal_is_not_loaded(self):
+        '''
+        Test that the investor list and my projects look the investor up by id without loading the user
+        '''
+        principal = TokenPrincipal({'user_id': self.user.id, **{claim: getattr(self.user, claim)
+                                                               for claim in PRINCIPAL_FIELDS}})
+        for path, view in (('/api/projects/', self.view), ('/api/projects/my/',
+                                                            ProjectViewSet.as_view({'get': 'get_my_projects'}))):
+            request = self.factory.get(path)
+            force_authenticate(request, user=principal)
+            self.assertEqual(view(request).status_code, status.HTTP_200_OK)
+        self.assertIs(principal._wrapped, empty)
+
+    def test_investment_total_follows_ledger(self):
+        '''
+        Test that every created investment is added to the rollup
+        '''
+        self.assertEqual(InvestmentTotal.get_total(self.investor, self.projects[0]), Decimal('150'))
+        self.assertEqual(InvestmentTotal.get_total(self.investor, self.projects[1]), Decimal('25'))
+        self.assertEqual(InvestmentTotal.get_total(self.investor, self.projects[2]), 0)
+
+    def test_rebuild_investment_totals(self):
+        '''
+        Test that the management command detects a drifted rollup and rebuilds it from the ledger
+        '''
+        InvestmentTotal.objects.filter(project=self.projects[0]).update(total_investment=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_investment_totals', verify_only=True, stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_investment_totals', stdout=StringIO())
+        self.assertEqual(InvestmentTotal.get_total(self.investor, self.projects[0]), Decimal('150'))
+
+
+class InvestToProjectTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ProjectViewSet.as_view({'post': 'invest_to_project'})
+        self.user = mixer.blend(CustomUser, is_investor=True, is_startup=False)
+        self.investor = mixer.blend(Investor, user=self.user, is_active=True, is_verified=True,
+                                    investment_amount=Decimal('1000'))
+        self.startup = mixer.blend(Startup)
+        self.project = mixer.blend(Project, startup=self.startup, is_active=True, is_verified=True,
+                                   status='approved', budget_needed=Decimal('500'), budget_ready=Decimal('0'))
+
+    def invest(self, amount):
+        request = self.factory.post(f'/api/projects/{self.project.id}/invest/', {'investment_amount': amount},
+                                    format='json')
+        force_authenticate(request, user=self.user)
+        return self.view(request, pk=self.project.id)
+
+    def test_invest_to_project_success(self):
+        '''
+        Test for positive case of investing: balances, rollup, investors and status are updated together
+        '''
+        self.invest('200')
+        response = self.invest('300')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_investment_by_investor_to_project'], Decimal('500'))
+        self.assertEqual(response.data['project_status'], 'completed')
+        self.investor.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(self.investor.investment_amount, Decimal('500'))
+        self.assertEqual(self.project.budget_ready, Decimal('500'))
+        self.assertTrue(self.project.investors.filter(id=self.investor.id).exists())
+
+    def test_invest_not_enough_money(self):
+        '''
+        Test for negative case of investing more than the investor's balance
+        '''
+        response = self.invest('1500')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Investment.objects.exists())
+
+
+class BulkInvestToProjectsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ProjectViewSet.as_view({'post': 'bulk_invest_to_projects'})
+        self.user = mixer.blend(CustomUser, is_investor=True, is_startup=False)
+        self.investor = mixer.blend(Investor, user=self.user, is_active=True, is_verified=True,
+                                    investment_amount=Decimal('1000'))
+        self.startup = mixer.blend(Startup)
+        self.projects = [
+            mixer.blend(Project, startup=self.startup, is_active=True, is_verified=True, status='approved',
+                        budget_needed=Decimal('500'), budget_ready=Decimal('0'))
+            for _ in range(3)
+        ]
+
+    def bulk_invest(self, investments):
+        request = self.factory.post('/api/projects/bulk_invest/', {'investments': investments}, format='json')
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_bulk_invest_success(self):
+        '''
+        Test for positive case of bulk investing, with a per-project result for a missing project
+        '''
+        missing_id = self.projects[-1].id + 100
+        response = self.bulk_invest([
+            {'project_id': self.projects[1].id, 'investment_amount': '500'},
+            {'project_id': missing_id, 'investment_amount': '10'},
+            {'project_id': self.projects[0].id, 'investment_amount': '100'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['success', 'failed', 'success'])
+        self.assertEqual(results[0]['project_status'], 'completed')
+        self.assertEqual(results[2]['total_investment_by_investor_to_project'], Decimal('100'))
+        self.investor.refresh_from_db()
+        self.assertEqual(self.investor.investment_amount, Decimal('400'))
+        self.assertEqual(Investment.objects.count(), 2)
+        self.assertEqual(InvestmentTotal.get_total(self.investor, self.projects[1]), Decimal('500'))
+        self.assertEqual(set(self.investor.participated_projects.all()), {self.projects[0], self.projects[1]})
+
+    def test_bulk_invest_not_enough_money(self):
+        '''
+        Test for negative case of bulk investing more than the investor's balance in total
+        '''
+        response = self.bulk_invest([
+            {'project_id': project.id, 'investment_amount': '400'} for project in self.projects
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Investment.objects.exists())
+
+    def test_bulk_invest_balance_counts_only_charged_projects(self):
+        '''
+        Test that projects that are not found do not count against the investor's balance
+        '''
+        missing_id = self.projects[-1].id + 100
+        response = self.bulk_invest([
+            {'project_id': self.projects[0].id, 'investment_amount': '300'},
+            {'project_id': missing_id, 'investment_amount': '900'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']], ['success', 'failed'])
+        self.investor.refresh_from_db()
+        self.assertEqual(self.investor.investment_amount, Decimal('700'))
+
+    def test_bulk_invest_duplicate_project(self):
+        '''
+        Test for negative case of listing one project twice
+        '''
+        response = self.bulk_invest([
+            {'project_id': self.projects[0].id, 'investment_amount': '10'},
+            {'project_id': self.projects[0].id, 'investment_amount': '20'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentInvestmentTest(TransactionTestCase):
+    workers = 8
+    investments_per_worker = 5
+
+    def setUp(self):
+        self.user = mixer.blend(CustomUser, is_investor=True, is_startup=False)
+        self.investor = mixer.blend(Investor, user=self.user, is_active=True, is_verified=True,
+                                    investment_amount=Decimal('1000'))
+        self.startup = mixer.blend(Startup)
+        self.project = mixer.blend(Project, startup=self.startup, is_active=True, is_verified=True,
+                                   status='approved', budget_needed=Decimal('100000'), budget_ready=Decimal('0'))
+
+    def test_parallel_investments_do_not_lose_updates(self):
+        '''
+        Test that parallel investments into one project from one investor are all accounted for
+        '''
+        barrier = Barrier(self.workers)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.investments_per_worker):
+                    calculate_investment(self.investor, self.project, Decimal('10'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        invested = Decimal('10') * self.workers * self.investments_per_worker
+        self.assertEqual(errors, [])
+        self.investor.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(self.investor.investment_amount, Decimal('1000') - invested)
+        self.assertEqual(self.project.budget_ready, invested)
+        self.assertEqual(InvestmentTotal.get_total(self.investor, self.project), invested)
+        self.assertEqual(Investment.objects.count(), self.workers * self.investments_per_worker)
+
+
+class ProjectConditionalGetTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ProjectViewSet.as_view({'get': 'retrieve'})
+        self.user = mixer.blend(CustomUser, is_investor=True, is_startup=False)
+        self.investor = mixer.blend(Investor, user=self.user, is_active=True, is_verified=True)
+        self.other_user = mixer.blend(CustomUser, is_investor=False, is_startup=False)
+        self.project = mixer.blend(Project, startup=mixer.blend(Startup), is_active=True, is_verified=True)
+
+    def retrieve(self, user, **headers):
+        request = self.factory.get(f'/api/projects/{self.project.id}/', **headers)
+        force_authenticate(request, user=user)
+        return self.view(request, pk=self.project.id)
+
+    def test_not_modified_with_one_query(self):
+        '''
+        Test that a matching If-None-Match is answered with 304 after a single timestamp lookup
+        '''
+        etag = self.retrieve(self.user)['ETag']
+        with self.assertNumQueries(1):
+            response = self.retrieve(self.user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_varies_by_user(self):
+        '''
+        Test that users with another role do not get each other's representation
+        '''
+        etag = self.retrieve(self.user)['ETag']
+        response = self.retrieve(self.other_user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_subscribers(self):
+        '''
+        Test that a new subscriber changes the project version
+        '''
+        Project.objects.filter(id=self.project.id).update(updated_at=timezone.now() - timedelta(minutes=1))
+        etag = self.retrieve(self.user)['ETag']
+        self.project.subscribers.add(self.investor)
+        response = self.retrieve(self.user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(self.investor.id, response.data['subscribers'])
+
+    def test_etag_changes_with_industry_and_location_names(self):
+        '''
+        Test that renaming the project's industry or location changes the project version
+        '''
+        self.project.industry = mixer.blend(Industry)
+        self.project.location = mixer.blend(Location)
+        self.project.save()
+        for related in (self.project.industry, self.project.location):
+            Project.objects.filter(id=self.project.id).update(updated_at=timezone.now() - timedelta(minutes=1))
+            etag = self.retrieve(self.user)['ETag']
+            related.name = f'Renamed {related.id}'
+            related.save()
+            response = self.retrieve(self.user, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(related.name, (response.data['industry'], response.data['location']))
@@ -1,5 +1,14 @@
-from django.db.models import Sum
-from projects.models import Investment
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from investors.models import Investor
+from projects.models import Investment, InvestmentTotal, Project, project_search_vector
+from rest_framework import serializers
+from startups.models import SEARCH_CONFIG
+
+NOT_ENOUGH_MONEY_MESSAGE = "Not enough money for investing. Please - top up the balance."
 
 
 def filter_by_budget(queryset, budget_filter):
@@ -17,14 +26,24 @@ def filter_by_budget(queryset, budget_filter):
     return queryset
 
 
+def search_projects(queryset, text):
+    """
+    Full-text search over project name, goals and description (GIN indexed).
+    Matching projects get a `rank` annotation, the higher the more relevant.
+    """
+    query = SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+    # ts_rank returns real; casting to double keeps the rank exact in keyset pagination cursors
+    rank = Cast(SearchRank(project_search_vector(), query), FloatField())
+    return queryset.annotate(search=project_search_vector(), rank=rank).filter(search=query)
+
+
 def filter_projects(queryset, data, request):
     allowed_budget_keys = ['bgt', 'blt']
     budget_filter = {key: data.pop(key, None) for key in allowed_budget_keys if key in data}
 
-    not_exact_key = 'project_name'
-    if not_exact_key in data:
-        project_name_filter = data.pop('project_name')
-        queryset = queryset.filter(project_name__icontains=project_name_filter)
+    search_text = data.pop('project_name', '').strip()
+    if search_text:
+        queryset = search_projects(queryset, search_text)
 
     queryset = queryset.filter(**data)
 
@@ -60,41 +79,55 @@ def calculate_difference(project1, project2):
     return difference
 
 
+def update_project_budget(project, investment_amount):
+    """
+    Add an investment to the project's budget_ready and move the project to 'completed'
+    once the budget is collected. Does not save the project.
+    """
+    project.budget_ready = (project.budget_ready or 0) + investment_amount
+    if project.budget_ready >= project.budget_needed:
+        project.status = 'completed'
+
+
 def calculate_investment(investor, project, investment_amount):
     """
     The calculate_investment function takes in an investor, a project and the amount to be invested.
-    It then updates the investment_amount of the investor by subtracting it from his/her current investment_amount.
+    Everything happens in one transaction with the investor and project rows locked (select_for_update),
+    so concurrent investments can not overwrite each other's balance changes.
+    It updates the investment_amount of the investor by subtracting it from his/her current investment_amount.
     The budget_ready of the project is updated by adding it to its current budget_ready value.
-    An Investment object is created with details about who invested what into which project and how much was invested.
-    If after this transaction, if budget ready exceeds or equals budget needed for that particular project, then status of that particular
-    project changes to 'completed'. The function returns a dictionary containing information for Response.
+    An Investment object is created with details about who invested what into which project and how much was invested,
+    and the investor's InvestmentTotal for the project is updated in the same transaction.
+    If budget ready exceeds or equals budget needed for that particular project, then status of that particular
+    project changes to 'completed'. The investor is added to the project's investors.
+    The function returns a dictionary containing information for Response.
 
     :param investor: Get the investor object from the database
     :param project: Get the project object from the database
     :param investment_amount: Pass the amount of money that the investor wants to invest in a project
     :return: A dictionary for Response.
+    :raises serializers.ValidationError: If the locked investor balance is lower than the investment amount.
 
     """
-    investor.investment_amount -= investment_amount
-    investor.save()
+    with transaction.atomic():
+        investor = Investor.objects.select_for_update(of=("self",)).select_related("user").get(pk=investor.pk)
+        project = Project.objects.select_for_update().get(pk=project.pk)
+        if investment_amount > investor.investment_amount:
+            raise serializers.ValidationError({
+                "status": "failed",
+                "message": NOT_ENOUGH_MONEY_MESSAGE
+            })
 
-    project.budget_ready += investment_amount
-    project.save()
+        investor.investment_amount -= investment_amount
+        investor.save(update_fields=["investment_amount", "updated_at"])
 
-    investment = Investment(
-        investor=investor,
-        project=project,
-        amount_invested=investment_amount,
-    )
-    investment.save()
+        update_project_budget(project, investment_amount)
+        project.save(update_fields=["budget_ready", "status", "updated_at"])
+
+        Investment.create_investment(investor, project, investment_amount)
+        project.investors.add(investor)
+        total_investment_amount = InvestmentTotal.get_total(investor, project)
 
-    if project.budget_ready > project.budget_needed:
-        project.status = 'completed'
-        project.save()
-    investor_investment = Investment.objects.filter(investor=investor, project=project)
-    investor_investment = investor_investment.aggregate(total_investment=Sum('amount_invested'))
-    total_investment_amount = investor_investment['total_investment'] if investor_investment[
-                                                                             'total_investment'] is not None else 0
     return {
         "investor_name": investor.user.first_name,
         "project_name": project.project_name,
@@ -104,3 +137,84 @@ def calculate_investment(investor, project, investment_amount):
         "project_budget_ready": project.budget_ready,
         "project_status": project.status
     }
+
+
+def calculate_bulk_investment(investor, allocations):
+    """
+    Invest into several projects at once.
+    The investor row is locked first, then all projects in ascending id order, so concurrent bulk and
+    single investments always lock rows in the same order. The total amount is checked against the
+    investor balance once, Investment rows are inserted with one bulk_create and the projects are
+    saved with one bulk_update. Projects that are not active or not verified are reported as failed
+    items and are not charged.
+
+    :param investor: The investor who invests
+    :param allocations: A list of dicts with 'project_id' and 'investment_amount' keys
+    :return: A dictionary for Response with a result for every allocation, in request order.
+    :raises serializers.ValidationError: If the total amount is greater than the investor balance.
+    """
+    with transaction.atomic():
+        investor = Investor.objects.select_for_update(of=("self",)).select_related("user").get(pk=investor.pk)
+        project_ids = [allocation["project_id"] for allocation in allocations]
+        projects = {
+            project.id: project
+            for project in Project.objects.select_for_update().filter(
+                id__in=project_ids, is_active=True, is_verified=True
+            ).order_by("id")
+        }
+        valid_allocations = [allocation for allocation in allocations if allocation["project_id"] in projects]
+        invested_total = sum(allocation["investment_amount"] for allocation in valid_allocations)
+        if invested_total > investor.investment_amount:
+            raise serializers.ValidationError({
+                "status": "failed",
+                "message": NOT_ENOUGH_MONEY_MESSAGE
+            })
+
+        now = timezone.now()
+        investments = []
+        for allocation in valid_allocations:
+            project = projects[allocation["project_id"]]
+            update_project_budget(project, allocation["investment_amount"])
+            project.updated_at = now
+            investments.append(
+                Investment(investor=investor, project=project, amount_invested=allocation["investment_amount"])
+            )
+
+        if investments:
+            investor.investment_amount -= invested_total
+            investor.save(update_fields=["investment_amount", "updated_at"])
+            Project.objects.bulk_update(projects.values(), ["budget_ready", "status", "updated_at"])
+            Investment.create_investments(investments)
+            investor.participated_projects.add(*projects.values())
+        totals = dict(
+            InvestmentTotal.objects.filter(investor=investor, project_id__in=projects).values_list(
+                "project_id", "total_investment"
+            )
+        )
+
+    results = []
+    for allocation in allocations:
+        project = projects.get(allocation["project_id"])
+        if project is None:
+            results.append({
+                "project_id": allocation["project_id"],
+                "status": "failed",
+                "message": "Project not found"
+            })
+            continue
+        results.append({
+            "project_id": project.id,
+            "project_name": project.project_name,
+            "status": "success",
+            "invested": allocation["investment_amount"],
+            "total_investment_by_investor_to_project": totals[project.id],
+            "project_budget_needed": project.budget_needed,
+            "project_budget_ready": project.budget_ready,
+            "project_status": project.status
+        })
+    return {
+        "investor_name": investor.user.first_name,
+        "invested": invested_total,
+        "investor_balance": investor.investment_amount,
+        "results": results
+    }
@@ -5,17 +5,18 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from drf_yasg.utils import swagger_auto_schema
+from forum.cache import cache_anonymous_response
+from forum.conditional import conditional_response
+from forum.pagination import KeysetPagination, RankedKeysetPagination
 from investors.models import Investor
 from projects.models import Project, Location
 from projects.permissions import IsInvestor
 from startups.models import Startup, Industry
-from notifications.tasks import project_updating, project_subscription
 from drf_yasg import openapi
-from notifications.signals import project_created_signal, project_subscription_signal, project_updated_interests_signal, \
-    project_updated_signal
-from projects.serializers import InvestToProjectSerializer, ProjectSerializer, ProjectSerializerUpdate, \
-    ProjectViewSerializer
-from projects.utils import calculate_difference, calculate_investment, filter_projects
+from notifications.signals import project_created_signal, project_subscription_signal, project_updated_signal
+from projects.serializers import BulkInvestToProjectsSerializer, InvestToProjectSerializer, ProjectSerializer, \
+    ProjectSerializerUpdate, ProjectViewSerializer
+from projects.utils import calculate_bulk_investment, calculate_difference, calculate_investment, filter_projects
 
 
 class ProjectViewSet(viewsets.ViewSet):
@@ -44,8 +45,9 @@ class ProjectViewSet(viewsets.ViewSet):
     - Responses contain the status of the operation, messages, and project data (in list, retrieve, create, update, partial_update operations).
     """
 
+    pagination_class = KeysetPagination
     free_methods = ("list", "retrieve", "compare_projects")
-    investors_methods = ("invest_to_project", "get_my_projects", "add_subscriber")
+    investors_methods = ("invest_to_project", "bulk_invest_to_projects", "get_my_projects", "add_subscriber")
     allowed_uqery_keys = (
         "project_name",
         "description",
@@ -66,34 +68,52 @@ class ProjectViewSet(viewsets.ViewSet):
 
     @swagger_auto_schema(
         operation_summary="Retrieve a list of all projects",
-        operation_description="Retrieve a list of all projects with optional filtering.",
+        operation_description="Retrieve a page of projects with optional filtering. "
+                              "`project_name` runs a full-text search over name, goals and description "
+                              "and orders projects by relevance. "
+                              "Follow the `next` link to get the next page.",
         tags=["Projects"],
+        manual_parameters=[
+            openapi.Parameter("cursor", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Opaque cursor from the `next` link of the previous page"),
+            openapi.Parameter("page_size", openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Number of projects per page"),
+        ],
         responses={
-            200: ProjectViewSerializer(),
+            200: ProjectViewSerializer(many=True),
             400: "Bad Request"
         }
     )
+    @cache_anonymous_response("projects")
     def list(self, request):
         # Implementation of GET METHOD - ExampLE URL: /api/projects/
         # Getting ALL projects logic
-        if request.user.is_investor:
-            queryset_projects = Project.objects.filter(is_active=True, is_verified=True)
+        queryset_projects = Project.objects.select_related("industry", "location").prefetch_related(
+            "subscribers", "investors"
+        )
+        if getattr(request.user, "is_investor", False):
+            queryset_projects = queryset_projects.filter(is_active=True, is_verified=True)
         else:
-            queryset_projects = Project.objects.filter(is_active=True)
+            queryset_projects = queryset_projects.filter(is_active=True)
         query_params = request.query_params
+        paginator = self.pagination_class()
         if query_params:
             filtered_query_data = {
                 key: query_params[key]
                 for key in query_params
                 if key in self.allowed_uqery_keys
             }
+            if filtered_query_data.get("project_name", "").strip():
+                # Full-text search results are ordered by relevance, a blank name does not filter
+                paginator = RankedKeysetPagination()
             queryset_projects = filter_projects(
                 queryset_projects, filtered_query_data, request
             )
+        page = paginator.paginate_queryset(queryset_projects, request, view=self)
         serializer = ProjectViewSerializer(
-            queryset_projects, many=True, context={"request": request}
+            page, many=True, context={"request": request}
         )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
 
     @swagger_auto_schema(
         operation_summary="Retrieve information about a specific project by its ID",
@@ -104,12 +124,16 @@ class ProjectViewSet(viewsets.ViewSet):
             404: "Not Found"
         }
     )
+    @conditional_response(lambda request, pk=None: Project.objects.filter(id=pk, is_active=True))
+    @cache_anonymous_response("projects")
     def retrieve(self, request, pk=None):
         # Implementation of GET METHOD for one project - ExampLE URL: /api/projects/2
         # Getting ONE project with id=project logic
         project_id = pk
         try:
-            project = get_object_or_404(Project, is_active=True, id=project_id)
+            project = get_object_or_404(
+                Project.objects.select_related("industry", "location"), is_active=True, id=project_id
+            )
         except Project.DoesNotExist:
             return Response(
                 {"detail": f"Project with id {pk} not found."},
@@ -243,15 +267,7 @@ class ProjectViewSet(viewsets.ViewSet):
         serializer.validated_data['is_verified'] = False
         serializer.save()
 
-        for investor in project.subscribers.all():
-            project_updated_signal.send(
-                sender=Project, investor_id=investor.id, project_id=project.id
-            )
-
-        interested_investors = Investor.objects.filter(interests__name=project.industry.name).distinct()
-
-        for investor in interested_investors:
-            project_updated_interests_signal.send(sender=Project, project_id=project.id, subscriber_id=investor.id)
+        project_updated_signal.send(sender=Project, project_id=project.id)
 
         data = {
             "project_id": pk,
@@ -328,15 +344,7 @@ class ProjectViewSet(viewsets.ViewSet):
         serializer.validated_data['is_verified'] = False
         serializer.save()
 
-        for investor in project.subscribers.all():
-            project_updated_signal.send(
-                sender=Project, investor_id=investor.id, project_id=project.id
-            )
-
-        interested_investors = Investor.objects.filter(interests__name=project.industry.name).distinct()
-
-        for investor in interested_investors:
-            project_updated_interests_signal.send(sender=Project, project_id=project.id, subscriber_id=investor.id)
+        project_updated_signal.send(sender=Project, project_id=project.id)
 
         data = {
             "project_id": pk,
@@ -376,7 +384,9 @@ class ProjectViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'], url_path='my')
     def get_my_projects(self, request):
         user = self.request.user
-        investors_projects = Project.objects.filter(investors__user=user, is_active=True)
+        investors_projects = Project.objects.select_related('industry', 'location').prefetch_related(
+            'subscribers', 'investors'
+        ).filter(investors__user_id=user.id, is_active=True)
         serializer = ProjectViewSerializer(investors_projects, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -404,20 +414,48 @@ class ProjectViewSet(viewsets.ViewSet):
         try:
             user = request.user
             project = get_object_or_404(Project, is_active=True, is_verified=True, id=pk)
-            investor = get_object_or_404(Investor, user=user, is_active=True, is_verified=True)
+            investor = get_object_or_404(Investor, user_id=user.id, is_active=True, is_verified=True)
             serializer = InvestToProjectSerializer(data=request.data,
                                                    context={'project': project, 'investor': investor})
             serializer.is_valid(raise_exception=True)
             investment_amount = serializer.validated_data['investment_amount']
             result = calculate_investment(investor, project, investment_amount)
-            if not project.investors.filter(id=investor.id).exists():
-                project.investors.add(investor)
             return Response(result, status=status.HTTP_200_OK)
         except Http404 as e:
             return Response({
                 'detail': f'{str(e)}'
             }, status=status.HTTP_404_NOT_FOUND)
 
+    @swagger_auto_schema(
+        operation_summary="Invest into several projects at once",
+        operation_description="Invest into several projects with one request. "
+                              "Returns a result for every project in the request.",
+        tags=["Projects"],
+        request_body=BulkInvestToProjectsSerializer(),
+        responses={
+            200: "Investments processed",
+            400: "Bad Request",
+            404: "Not Found"
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='bulk_invest')
+    def bulk_invest_to_projects(self, request):
+        """
+        Invest into several projects with one request (POST /api/projects/bulk_invest/).
+        Expects {"investments": [{"project_id": 1, "investment_amount": 100}, ...]}.
+        The total amount of the projects that can be charged is checked against the investor balance
+        once, under the investor row lock, and all investments are saved in one transaction.
+        Projects that are not active or not verified are reported as failed items and are not charged.
+
+        :param request: Get the user and the list of investments from the request
+        :return: Response: A response with a result for every requested project.
+        """
+        investor = get_object_or_404(Investor, user_id=request.user.id, is_active=True, is_verified=True)
+        serializer = BulkInvestToProjectsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = calculate_bulk_investment(investor, serializer.validated_data['investments'])
+        return Response(result, status=status.HTTP_200_OK)
+
     @swagger_auto_schema(
         operation_summary="Add a subscriber to the project",
         operation_description="Add a subscriber to the specified project.",
@@ -445,7 +483,7 @@ class ProjectViewSet(viewsets.ViewSet):
         try:
             user = request.user
             project = get_object_or_404(Project, is_active=True, id=pk)
-            subscriber = get_object_or_404(Investor, user=user, is_active=True)
+            subscriber = get_object_or_404(Investor, user_id=user.id, is_active=True)
 
             if project.subscribers.filter(id=subscriber.id).exists():
                 project.subscribers.remove(subscriber)
@@ -1,7 +1,10 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.db import models
 from users.models import CustomUser
 from django.utils import timezone
 
+SEARCH_CONFIG = "english"
 
 
 class Industry(models.Model):
@@ -15,6 +18,17 @@ class Industry(models.Model):
 
 
 
+def startup_search_vector():
+    """
+    Weighted full-text vector over name and description.
+    The same expression is indexed in Startup.Meta, queries must use it to hit the GIN index.
+    """
+    return (
+        SearchVector("startup_name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("description", weight="B", config=SEARCH_CONFIG)
+    )
+
+
 class Startup(models.Model):
     id = models.AutoField(primary_key=True)
     owner = models.ForeignKey(
@@ -35,10 +49,14 @@ class Startup(models.Model):
     is_verified = models.BooleanField(default=False)
     registration_date = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'startups'
         app_label = 'startups'
+        indexes = [
+            GinIndex(startup_search_vector(), name="startups_search_idx"),
+        ]
 
     def __str__(self):
         return self.startup_name
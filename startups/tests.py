@@ -1,5 +1,6 @@
 from rest_framework import status
 from rest_framework.test import force_authenticate, APIRequestFactory
+from django.core.cache import cache
 from django.test import TestCase
 from mixer.backend.django import mixer
 
@@ -46,6 +47,7 @@ class IndustryModelTestCase(TestCase):
 
 class StartupViewSetTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.factory = APIRequestFactory()
         self.view = StartupViewSet.as_view({'get': 'list', 'post': 'create', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'})
         self.user = mixer.blend(CustomUser, is_startup=True)
@@ -245,7 +247,37 @@ class StartupViewSetTest(TestCase):
         startup = Startup.objects.get(pk=self.startup.id)
         self.assertTrue(startup.is_active) if projects_exist else self.assertFalse(startup.is_active)
 
+    def test_list_startups_with_industry_filter(self):
+        """
+        Test that a filtered startup list is fetched with one query
+        """
+        request = self.factory.get(self.url, {'industry': 'health'})
+        with self.assertNumQueries(1):
+            response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([startup['industries'] for startup in response.data], ['Health Care'])
 
+    def test_list_startups_unknown_industry(self):
+        """
+        Test for negative case of listing startups of an industry without startups
+        """
+        request = self.factory.get(self.url, {'industry': 'Space'})
+        response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['error'], "No startups found for the industry 'Space'")
 
+    def test_anonymous_list_is_cached_until_startup_changes(self):
+        """
+        Test that anonymous listings are served from the cache and refreshed after a startup is saved
+        """
+        request = self.factory.get(self.url, {'industry': 'health'})
+        self.view(request)
+        with self.assertNumQueries(0):
+            response = self.view(self.factory.get(self.url, {'industry': 'health'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-
+        self.startup.description = 'Fresh description'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.startup.save()
+        response = self.view(self.factory.get(self.url, {'industry': 'health'}))
+        self.assertEqual(response.data[0]['description'], 'Fresh description')
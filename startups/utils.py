@@ -0,0 +1,15 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .models import SEARCH_CONFIG, startup_search_vector
+
+
+def search_startups(queryset, text):
+    """
+    Full-text search over startup name and description (GIN indexed).
+    Matching startups get a `rank` annotation, the higher the more relevant.
+    """
+    query = SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+    rank = Cast(SearchRank(startup_search_vector(), query), FloatField())
+    return queryset.annotate(search=startup_search_vector(), rank=rank).filter(search=query)
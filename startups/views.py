@@ -6,15 +6,17 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from drf_yasg.utils import swagger_auto_schema
+from forum.cache import cache_anonymous_response
+from forum.conditional import conditional_response
 from projects.models import Project
 from projects.models import Project
-from users.models import CustomUser
 from .models import Industry, Startup
 from .serializers import (
     StartupListSerializer,
     StartupSerializer,
     StartupSerializerUpdate,
 )
+from .utils import search_startups
 
 class IsStartupPermission(permissions.BasePermission):
     """
@@ -61,36 +63,41 @@ class StartupViewSet(viewsets.ViewSet):
 
     @swagger_auto_schema(
         operation_summary="Retrieve a list of all startups",
-        operation_description="Retrieve a list of all startups with optional filtering.",
+        operation_description="Retrieve a list of all startups with optional filtering. "
+                              "`name` runs a full-text search over name and description "
+                              "and orders startups by relevance.",
         tags=["Startups"],
         responses={
             200: StartupListSerializer,
             400: "Bad Request"
         },
     )
+    @cache_anonymous_response("startups")
     def list(self, request):
         # Example URL: /api/startups/
         # Getting ALL startups logic
-        startups = Startup.objects.filter(is_active=True)
+        startups = Startup.objects.select_related("industries").filter(is_active=True)
         filter_queryset_by_params_response = self.filter_queryset_by_params(
             startups, request.query_params
         )
-        filtered_startups = filter_queryset_by_params_response["queryset"]
         if filter_queryset_by_params_response["status"] == "error":
             return Response(
                 {"error": filter_queryset_by_params_response["massage"]},
                 status=status.HTTP_404_NOT_FOUND,
             )
-        if not filtered_startups.exists():
+        # One query fetches the startups, the reason of an empty result is only looked up when needed
+        filtered_startups = list(filter_queryset_by_params_response["queryset"])
+        if not filtered_startups:
             return Response(
-                {"error": "Startups not found"}, status=status.HTTP_404_NOT_FOUND
+                {"error": self.get_not_found_message(request.query_params)},
+                status=status.HTTP_404_NOT_FOUND,
             )
         serializer = StartupListSerializer(filtered_startups, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def filter_queryset_by_params(self, queryset, query_params):
         # Example URL: /api/startups/?industry=test
-        # Example URL: /api/startups/?name=test
+        # Example URL: /api/startups/?name=test (full-text search, most relevant first)
         industry = query_params.get("industry")
         name = query_params.get("name")
         other_params = query_params.keys() - {"industry", "name"}
@@ -102,22 +109,32 @@ class StartupViewSet(viewsets.ViewSet):
             }
         if industry:
             queryset = queryset.filter(industries__name__icontains=industry)
-            if not queryset.exists():
-                return {
-                    "queryset": queryset.none(),
-                    "status": "error",
-                    "massage": f"No startups found for the industry '{industry}'",
-                }
         if name:
-            queryset = queryset.filter(startup_name__icontains=name)
-            if not queryset.exists():
-                return {
-                    "queryset": queryset.none(),
-                    "status": "error",
-                    "massage": f"No startups found with the name '{name}'",
-                }
+            queryset = search_startups(queryset, name).order_by("-rank", "-id")
         return {"queryset": queryset, "status": "success", "massage": ""}
 
+    @staticmethod
+    def get_not_found_message(query_params):
+        """
+        Explain an empty startup list: the industry filter is applied first, so
+        "no match for industry X" wins over "no match for name Y".
+        Costs one extra query only when both filters are given.
+        """
+        industry = query_params.get("industry")
+        name = query_params.get("name")
+        industry_message = f"No startups found for the industry '{industry}'"
+        name_message = f"No startups found with the name '{name}'"
+        if industry and name:
+            industry_exists = Startup.objects.filter(
+                is_active=True, industries__name__icontains=industry
+            ).exists()
+            return name_message if industry_exists else industry_message
+        if industry:
+            return industry_message
+        if name:
+            return name_message
+        return "Startups not found"
+
     @swagger_auto_schema(
         operation_summary="Retrieve information about one startup by its ID",
         operation_description="Retrieve information about one startup by its ID.",
@@ -127,6 +144,7 @@ class StartupViewSet(viewsets.ViewSet):
             400: "Bad Request"
         },
     )
+    @cache_anonymous_response("startups")
     def retrieve(self, request, pk=None):
         # ExampLE URL: /api/startups/2
         # Getting ONE startup with id=startup_id logic
@@ -156,7 +174,7 @@ class StartupViewSet(viewsets.ViewSet):
     def create(self, request):
         # ExampLE URL: /api/startups/
         # Creating startup logic
-        existing_startup = Startup.objects.filter(owner=request.user).first()
+        existing_startup = Startup.objects.filter(owner_id=request.user.id).first()
         industry_name = request.data.get("industries")
         industry = get_object_or_404(Industry, name=industry_name)
         if existing_startup:
@@ -290,12 +308,9 @@ class StartupViewSet(viewsets.ViewSet):
         },
     )
     @action(detail=False, methods=["get"], url_path="profile")
+    @conditional_response(lambda request: Startup.objects.filter(owner_id=request.user.id, is_active=True))
     def get_my_profile(self, request):
-        jwt_token = request.auth
-        user_id = jwt_token.payload.get("id")
-        user_instance = CustomUser.objects.get(id=user_id)
-
-        startup = get_object_or_404(Startup, owner=user_instance, is_active=True)
+        startup = get_object_or_404(Startup, owner_id=request.user.id, is_active=True)
         serializer = StartupSerializer(startup)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -0,0 +1,215 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, TokenError
+
+from .models import CustomUser
+
+PRINCIPAL_FIELDS = ("first_name", "last_name", "is_investor", "is_startup")
+SESSION_CLAIM = "sid"
+TOKEN_CACHE_ALIAS = "tokens"
+
+
+class TokenPrincipal(SimpleLazyObject):
+    """
+    Authenticated user built from claims (id, names and role flags) instead of a users row.
+    Anything else, including using it as a CustomUser in a query or saving it, loads the row on first use.
+    """
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        user_id = claims[api_settings.USER_ID_CLAIM]
+
+        def load_user():
+            try:
+                return CustomUser.objects.get(id=user_id)
+            except CustomUser.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+
+        super().__init__(load_user)
+        self.__dict__["claims"] = claims
+
+    def __bool__(self):
+        return True
+
+    def get_claim(self, name):
+        """
+        Claims are used until the row is loaded, then the row, which may have been changed since.
+        """
+        if self._wrapped is not empty:
+            return getattr(self._wrapped, name)
+        return self.claims[name]
+
+    @property
+    def id(self):
+        if self._wrapped is not empty:
+            return self._wrapped.id
+        return self.claims[api_settings.USER_ID_CLAIM]
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def first_name(self):
+        return self.get_claim("first_name")
+
+    @property
+    def last_name(self):
+        return self.get_claim("last_name")
+
+    @property
+    def is_investor(self):
+        return self.get_claim("is_investor")
+
+    @property
+    def is_startup(self):
+        return self.get_claim("is_startup")
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the users query: request.user is a TokenPrincipal built from the token claims.
+
+    Tokens issued before the claims were added, or before the user's names, roles or active state changed
+    (see `invalidate_token_claims`), are authenticated with the users query as before. So are all tokens
+    when no shared token cache is configured, since the changes could not be seen by every process.
+    """
+
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in PRINCIPAL_FIELDS) or are_token_claims_stale(validated_token):
+            return super().get_user(validated_token)
+        return TokenPrincipal(
+            {
+                api_settings.USER_ID_CLAIM: validated_token[api_settings.USER_ID_CLAIM],
+                **{claim: validated_token[claim] for claim in PRINCIPAL_FIELDS},
+            }
+        )
+
+
+def get_token_claims(user):
+    """
+    Claims added to the tokens at login, enough to build a TokenPrincipal.
+    """
+    return {"id": user.id, **{claim: getattr(user, claim) for claim in PRINCIPAL_FIELDS}}
+
+
+def get_principal_cache_key(jti):
+    return f"token_principal:{jti}"
+
+
+def get_revoked_cache_key(session_id):
+    return f"token_session_revoked:{session_id}"
+
+
+def get_claims_changed_cache_key(user_id):
+    return f"token_claims_changed:{user_id}"
+
+
+def get_token_cache():
+    """
+    Cache shared by all processes for the claims change and session revocation markers, or None.
+    Configured only with Redis, in a cache that does not evict them (see settings.CACHES).
+    """
+    if TOKEN_CACHE_ALIAS not in settings.CACHES:
+        return None
+    return caches[TOKEN_CACHE_ALIAS]
+
+
+def invalidate_token_claims(user_id):
+    """
+    Stop trusting the names, role flags and active state in the tokens the user got until now.
+    Called when any of them is saved (see users.signals). Those tokens load the user from the database until they expire.
+    """
+    token_cache = get_token_cache()
+    if token_cache is not None:
+        token_cache.set(
+            get_claims_changed_cache_key(user_id),
+            int(time.time()),
+            timeout=int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+        )
+
+
+def are_token_claims_stale(token, issued_at=None):
+    """
+    Whether the user's claims changed after the token was issued, or after `issued_at` if given.
+    Without a shared token cache the claims are never trusted.
+    """
+    token_cache = get_token_cache()
+    if token_cache is None:
+        return True
+    changed_at = token_cache.get(get_claims_changed_cache_key(token[api_settings.USER_ID_CLAIM]))
+    if issued_at is None:
+        issued_at = token.get("iat", 0)
+    return changed_at is not None and issued_at <= changed_at
+
+
+def start_token_session(refresh):
+    """
+    Give a refresh token issued at login a new session id. The access tokens and the rotated
+    refresh tokens derived from it carry the same id, so the session can be revoked at once.
+    """
+    refresh[SESSION_CLAIM] = uuid4().hex
+
+
+def revoke_token_session(token):
+    """
+    Reject the access tokens of the token's session, e.g. after its refresh token was blacklisted on logout.
+    Kept for the access token lifetime, the revoked tokens have expired after that.
+    Tokens issued without a session id cannot be revoked, neither can any token without a shared token cache.
+    """
+    token_cache = get_token_cache()
+    if token_cache is not None and SESSION_CLAIM in token:
+        token_cache.set(
+            get_revoked_cache_key(token[SESSION_CLAIM]),
+            True,
+            timeout=int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+        )
+
+
+def is_token_revoked(token):
+    token_cache = get_token_cache()
+    return (
+        token_cache is not None
+        and SESSION_CLAIM in token
+        and token_cache.get(get_revoked_cache_key(token[SESSION_CLAIM])) is not None
+    )
+
+
+def authenticate_token(raw_token):
+    """
+    Principal of a valid access token, or None.
+
+    The signature, expiry and revocation are checked every time. With a shared token cache the users query
+    runs once per token: its principal is cached under the token's JTI until the token expires, or is
+    loaded again when the user's claims change. Without it the user is loaded every time.
+    """
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    if is_token_revoked(token):
+        return None
+
+    key = get_principal_cache_key(token[api_settings.JTI_CLAIM])
+    loaded_at, claims = cache.get(key, (None, None))
+    if claims is None or are_token_claims_stale(token, loaded_at):
+        user = (
+            CustomUser.objects.filter(id=token[api_settings.USER_ID_CLAIM], is_active=True)
+            .values("id", *PRINCIPAL_FIELDS)
+            .first()
+        )
+        if user is None:
+            return None
+        claims = {api_settings.USER_ID_CLAIM: user.pop("id"), **user}
+        cache.set(key, (int(time.time()), claims), timeout=max(token["exp"] - int(time.time()), 1))
+    return TokenPrincipal(claims)
@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
 from forum.utils import ValidationPatterns
+from .authentication import get_token_claims
 from .models import CustomUser
 
 
@@ -76,3 +80,21 @@ class UserSerializer(serializers.ModelSerializer):
             "is_startup",
             "registration_date",
         )
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that re-issues the names and role flags from the database, so the new access
+    and refresh tokens do not carry the claims of the login they were rotated from.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user = CustomUser.objects.filter(id=refresh[api_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+
+        refresh.payload.update(get_token_claims(user))
+        # The access token copies iat from the refresh token; claims loaded now are newer than any change before.
+        refresh.set_iat()
+        return super().validate({**attrs, "refresh": str(refresh)})
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from .authentication import PRINCIPAL_FIELDS, invalidate_token_claims
+from .models import CustomUser
+
+TOKEN_FIELDS = (*PRINCIPAL_FIELDS, "is_active")
+
+
+def get_token_field_values(instance):
+    # Deferred fields are left out instead of being loaded
+    return {field: instance.__dict__[field] for field in TOKEN_FIELDS if field in instance.__dict__}
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_token_fields(sender, instance, **kwargs):
+    """
+    Signal receiver keeping the values the user's tokens carry, to detect their changes on save.
+    """
+    instance._token_field_values = get_token_field_values(instance)
+
+
+@receiver(post_save, sender=CustomUser)
+def token_fields_saved(sender, instance, created, **kwargs):
+    """
+    Signal receiver invalidating the claims of the user's tokens when their names, roles or active state
+    change, wherever the user is saved (views, admin, shell).
+    """
+    values = get_token_field_values(instance)
+    if not created and values != instance._token_field_values:
+        invalidate_token_claims(instance.id)
+    instance._token_field_values = values
@@ -1,3 +1,288 @@
-from django.test import TestCase
+import asyncio
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from mixer.backend.django import mixer
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from livechat.middlewares import WebSocketJWTAuthMiddleware
+from startups.models import Startup
+from users.authentication import (
+    StatelessJWTAuthentication,
+    TokenPrincipal,
+    authenticate_token,
+    get_token_claims,
+    invalidate_token_claims,
+    start_token_session,
+)
+
+from users.models import CustomUser
+from users.serializers import ClaimsTokenRefreshSerializer
+from users.utils import get_display_names
+from users.views import LogoutAPIView, UserProfileView
+
+TOKEN_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'tokens': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tokens'},
+}
+
+
+class DisplayNameCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.users = [mixer.blend(CustomUser, first_name=f'Name{i}', last_name='Surname') for i in range(2)]
+        self.user_ids = [user.id for user in self.users]
+
+    def test_display_names_are_cached(self):
+        '''
+        Test that names are loaded with one query and then served from the cache
+        '''
+        with self.assertNumQueries(1):
+            names = get_display_names(self.user_ids)
+        self.assertEqual(names, {user.id: f'{user.first_name} Surname' for user in self.users})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_display_names(self.user_ids), names)
+
+    def test_profile_update_invalidates_display_name(self):
+        '''
+        Test that a name changed through the profile endpoint is not served stale
+        '''
+        user = CustomUser.objects.get(id=self.users[0].id)
+        get_display_names([user.id])
+        token = AccessToken.for_user(user)
+        token['id'] = user.id
+        request = self.factory.put('/api/users/profile/', {'first_name': 'Renamed'}, format='json')
+        force_authenticate(request, user=user, token=token)
+        response = UserProfileView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_display_names([user.id]), {user.id: 'Renamed Surname'})
+
+
+@override_settings(CACHES=TOKEN_CACHES)
+class TokenAuthenticationCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['tokens'].clear()
+        self.user = mixer.blend(CustomUser, first_name='John', last_name='Doe', is_investor=True)
+        self.refresh = RefreshToken.for_user(self.user)
+        start_token_session(self.refresh)
+        self.access = str(self.refresh.access_token)
+
+    def test_principal_is_cached_per_token(self):
+        '''
+        Test that the user is loaded once per token and the principal carries names and role flags
+        '''
+        with self.assertNumQueries(1):
+            authenticate_token(self.access)
+        with self.assertNumQueries(0):
+            principal = authenticate_token(self.access)
+        self.assertEqual((principal.id, principal.first_name, principal.last_name), (self.user.id, 'John', 'Doe'))
+        self.assertTrue(principal.is_investor)
+        self.assertFalse(principal.is_startup)
+
+    def test_invalid_token_is_rejected(self):
+        '''
+        Test that a malformed token is rejected without a users query
+        '''
+        with self.assertNumQueries(0):
+            self.assertIsNone(authenticate_token(self.access[:-2]))
+
+    def test_logout_revokes_cached_token(self):
+        '''
+        Test that blacklisting the refresh token on logout rejects the cached access token
+        '''
+        self.assertIsNotNone(authenticate_token(self.access))
+        request = APIRequestFactory().post('/api/users/logout/', {'refresh': str(self.refresh)}, format='json')
+        force_authenticate(request, user=self.user)
+        self.assertEqual(LogoutAPIView.as_view()(request).status_code, status.HTTP_200_OK)
+        self.assertIsNone(authenticate_token(self.access))
+
+    def test_refreshed_token_can_connect(self):
+        '''
+        Test that rotating the refresh token keeps the session's access tokens valid until logout
+        '''
+        serializer = ClaimsTokenRefreshSerializer(data={'refresh': str(self.refresh)})
+        self.assertTrue(serializer.is_valid())
+        access = serializer.validated_data['access']
+        self.assertIsNotNone(authenticate_token(access))
+        self.assertIsNotNone(authenticate_token(self.access))
+
+        request = APIRequestFactory().post(
+            '/api/users/logout/', {'refresh': serializer.validated_data['refresh']}, format='json')
+        force_authenticate(request, user=self.user)
+        self.assertEqual(LogoutAPIView.as_view()(request).status_code, status.HTTP_200_OK)
+        self.assertIsNone(authenticate_token(access))
+        self.assertIsNone(authenticate_token(self.access))
+
+    def test_logout_keeps_other_sessions(self):
+        '''
+        Test that logging out rejects only the tokens of the session that logged out
+        '''
+        other = RefreshToken.for_user(self.user)
+        start_token_session(other)
+        request = APIRequestFactory().post('/api/users/logout/', {'refresh': str(self.refresh)}, format='json')
+        force_authenticate(request, user=self.user)
+        LogoutAPIView.as_view()(request)
+        self.assertIsNone(authenticate_token(self.access))
+        self.assertIsNotNone(authenticate_token(str(other.access_token)))
+
+    def test_websocket_without_token_is_anonymous(self):
+        '''
+        Test that a socket without a token is rejected cheaply instead of failing
+        '''
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        with self.assertNumQueries(0):
+            asyncio.run(WebSocketJWTAuthMiddleware(app)({'query_string': b''}, None, None))
+        self.assertIsInstance(scopes[0]['user'], AnonymousUser)
+
+
+@override_settings(CACHES=TOKEN_CACHES)
+class StatelessJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['tokens'].clear()
+        self.factory = APIRequestFactory()
+        self.user = mixer.blend(CustomUser, first_name='John', last_name='Doe', is_startup=True)
+
+    def get_profile_request(self):
+        token = AccessToken.for_user(self.user)
+        token.payload.update(get_token_claims(self.user))
+        return self.factory.get('/api/users/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_profile_is_loaded_once(self):
+        '''
+        Test that authentication does not query the user and the profile view loads it only once
+        '''
+        request = self.get_profile_request()
+        with self.assertNumQueries(1):
+            response = UserProfileView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], self.user.email)
+
+    def test_principal_is_built_from_claims(self):
+        '''
+        Test that the principal answers id, names and roles from the claims and loads the row lazily
+        '''
+        token = AccessToken.for_user(self.user)
+        token.payload.update(get_token_claims(self.user))
+        with self.assertNumQueries(0):
+            principal, _ = StatelessJWTAuthentication().authenticate(
+                self.factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+            self.assertEqual((principal.id, principal.first_name, principal.is_startup), (self.user.id, 'John', True))
+            self.assertFalse(principal.is_investor)
+        with self.assertNumQueries(1):
+            self.assertEqual(principal.email, self.user.email)
+
+    def test_changed_claims_are_not_trusted(self):
+        '''
+        Test that tokens issued before a role change are authenticated with the users query
+        '''
+        token = AccessToken.for_user(self.user)
+        token.payload.update(get_token_claims(self.user))
+        CustomUser.objects.filter(id=self.user.id).update(is_investor=True)
+        invalidate_token_claims(self.user.id)
+        with self.assertNumQueries(1):
+            user, _ = StatelessJWTAuthentication().authenticate(
+                self.factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+        self.assertTrue(user.is_investor)
+
+    def test_deactivated_user_is_rejected(self):
+        '''
+        Test that tokens of a user who deleted their account are rejected, also when the principal is cached
+        '''
+        user = mixer.blend(CustomUser, is_investor=False, is_startup=False)
+        access = AccessToken.for_user(user)
+        access.payload.update(get_token_claims(user))
+        self.assertIsNotNone(authenticate_token(str(access)))
+        request = self.factory.delete('/api/users/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(UserProfileView.as_view()(request).status_code, status.HTTP_204_NO_CONTENT)
+
+        request = self.factory.get('/api/users/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(UserProfileView.as_view()(request).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIsNone(authenticate_token(str(access)))
+
+    def test_saved_token_fields_invalidate_claims(self):
+        '''
+        Test that saving a user anywhere invalidates their claims when names, roles or active state change
+        '''
+        request = self.get_profile_request()
+        user = CustomUser.objects.get(id=self.user.id)
+        user.profile_img_url = 'https://example.com/avatar.png'
+        user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(UserProfileView.as_view()(request).status_code, status.HTTP_200_OK)
+
+        user.is_active = False
+        user.save()
+        self.assertEqual(UserProfileView.as_view()(request).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_claims_are_not_trusted_without_token_cache(self):
+        '''
+        Test that without a shared token cache every token is checked against the users table
+        '''
+        request = self.get_profile_request()
+        CustomUser.objects.filter(id=self.user.id).update(is_active=False)
+        with override_settings(CACHES={'default': TOKEN_CACHES['default']}):
+            self.assertEqual(UserProfileView.as_view()(request).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        '''
+        Test that a token of a removed user gets 401 when the view loads the user
+        '''
+        request = self.get_profile_request()
+        CustomUser.objects.filter(id=self.user.id).delete()
+        self.assertEqual(UserProfileView.as_view()(request).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_reissues_claims(self):
+        '''
+        Test that refreshed tokens carry the current names and roles instead of those from the login
+        '''
+        refresh = RefreshToken.for_user(self.user)
+        refresh.payload.update(get_token_claims(self.user))
+        start_token_session(refresh)
+        CustomUser.objects.filter(id=self.user.id).update(is_investor=True, first_name='Jane')
+        invalidate_token_claims(self.user.id)
+
+        for _ in range(2):
+            serializer = ClaimsTokenRefreshSerializer(data={'refresh': str(refresh)})
+            self.assertTrue(serializer.is_valid())
+            refresh = RefreshToken(serializer.validated_data['refresh'])
+        access = AccessToken(serializer.validated_data['access'])
+        self.assertEqual((access['first_name'], access['is_investor']), ('Jane', True))
+        self.assertEqual(access['sid'], refresh['sid'])
+
+        user, _ = StatelessJWTAuthentication().authenticate(
+            self.factory.get('/', HTTP_AUTHORIZATION=f'Bearer {access}'))
+        self.assertEqual((user.first_name, user.is_investor), ('Jane', True))
+
+    def test_refresh_of_inactive_user_is_rejected(self):
+        '''
+        Test that a deactivated user cannot refresh their tokens
+        '''
+        refresh = RefreshToken.for_user(self.user)
+        CustomUser.objects.filter(id=self.user.id).update(is_active=False)
+        serializer = ClaimsTokenRefreshSerializer(data={'refresh': str(refresh)})
+        with self.assertRaises(AuthenticationFailed):
+            serializer.is_valid()
+
+    def test_principal_can_be_used_as_user_instance(self):
+        '''
+        Test that the principal loads the row when it is used in a query or saved
+        '''
+        principal = TokenPrincipal({'user_id': self.user.id, **{claim: getattr(self.user, claim)
+                                                               for claim in ('first_name', 'last_name', 'is_investor', 'is_startup')}})
+        self.assertEqual(CustomUser.objects.filter(id=principal.id).get(), principal)
+        principal.first_name = 'Renamed'
+        principal.save()
+        self.assertEqual(principal.first_name, 'Renamed')
+        self.assertEqual(CustomUser.objects.get(id=self.user.id).first_name, 'Renamed')
+        self.assertFalse(Startup.objects.filter(owner=principal).exists())
@@ -1,9 +1,36 @@
 import os
+from django.core.cache import cache
 from django.core.mail import send_mail
 
+from .models import CustomUser
+
 
 class Util:
     @staticmethod
     def send_email(data):
         send_mail(subject=data['email_subject'], message=data['email_body'],
                   from_email=os.environ.get('EMAIL_HOST_USER'), recipient_list=[data['to_email']])
+
+
+DISPLAY_NAME_CACHE_TIMEOUT = 60 * 60
+
+
+def get_display_names(user_ids):
+    """
+    "First Last" names of the given users, read from the shared cache.
+    Missing names are loaded with one query and cached for DISPLAY_NAME_CACHE_TIMEOUT seconds.
+    """
+    keys = {user_id: f"display_name:{user_id}" for user_id in user_ids}
+    cached = cache.get_many(keys.values())
+    names = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+    missing = [user_id for user_id in keys if user_id not in names]
+    if missing:
+        users = CustomUser.objects.filter(id__in=missing).values_list("id", "first_name", "last_name")
+        loaded = {user_id: f"{first_name} {last_name}" for user_id, first_name, last_name in users}
+        cache.set_many({keys[user_id]: name for user_id, name in loaded.items()}, DISPLAY_NAME_CACHE_TIMEOUT)
+        names.update(loaded)
+    return names
+
+
+def invalidate_display_names(user_ids):
+    cache.delete_many([f"display_name:{user_id}" for user_id in user_ids])
@@ -13,10 +13,11 @@ from rest_framework_simplejwt.tokens import RefreshToken
 # from investors.views import InvestorProfileView
 from users.serializers import PasswordResetConfirmSerializer, UserSerializer
 
+from .authentication import get_token_claims, revoke_token_session, start_token_session
 from .models import CustomUser
 from .serializers import UserRegisterSerializer
 from .swagger_auto_schema_settings import *
-from .utils import Util
+from .utils import Util, invalidate_display_names
 
 
 class LoginAPIView(APIView):
@@ -76,9 +77,8 @@ class LoginAPIView(APIView):
         user.save()
 
         refresh = RefreshToken.for_user(user)
-        refresh.payload.update(
-            {"id": user.id, "first_name": user.first_name, "last_name": user.last_name}
-        )
+        refresh.payload.update(get_token_claims(user))
+        start_token_session(refresh)
 
         return Response(
             {
@@ -130,6 +130,7 @@ class LogoutAPIView(APIView):
         try:
             token = RefreshToken(refresh_token)
             token.blacklist()
+            revoke_token_session(token)
         except Exception as e:
             return Response(
                 {"error": "Wrong refresh token."}, status=status.HTTP_400_BAD_REQUEST
@@ -414,10 +415,7 @@ class UserProfileView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get_current_user(self, request):
-        jwt_token = request.auth
-        user_id = jwt_token.payload.get("id")
-        user_instance = CustomUser.objects.get(id=user_id)
-        return user_instance
+        return request.user
 
     def get(self, request):
         user_instance = self.get_current_user(request)
@@ -430,6 +428,7 @@ class UserProfileView(APIView):
 
         if serializer.is_valid():
             serializer.save()
+            invalidate_display_names([user_instance.id])
             return Response(serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)